@@ -0,0 +1,13 @@
+# Benchmarks package
+import os
+
+# ID користувача, від імені якого генеруються дані та надсилаються оновлення
+BENCHMARK_USER_ID = 1
+
+# Бенчмарки працюють зі сховищем у пам'яті й не залежать від .env
+# (load_dotenv не перезаписує вже задані змінні середовища)
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ["DATABASE_BACKEND"] = "memory"
+os.environ["ALLOWED_USER_IDS"] = str(BENCHMARK_USER_ID)
+os.environ["DB_INSTRUMENTATION"] = "true"
+os.environ["METRICS_PORT"] = "0"
@@ -0,0 +1,75 @@
+import random
+from datetime import date, timedelta
+
+# Ціни за заняття, з яких випадково обирається base_price дитини
+BASE_PRICES = (300, 350, 400, 450, 500)
+# Скільки занять оплачується одним платежем
+LESSONS_PER_PAYMENT = 4
+
+
+async def generate_dataset(store, user_id: int, children: int = 20, years: float = 1, future_weeks: int = 4,
+                           completed_ratio: float = 0.85, cancelled_ratio: float = 0.08, paid_ratio: float = 0.9,
+                           seed: int = 0, today: date = None):
+    """
+    Синтетичні дані через публічний API сховища: у кожної дитини щотижневе заняття
+    в той самий день тижня й годину за years років до today і future_weeks тижнів наперед.
+    Минулі заняття проведені з імовірністю completed_ratio або скасовані з cancelled_ratio
+    (решта лишаються запланованими); paid_ratio проведених позначено оплаченими й покрито
+    оплатами по LESSONS_PER_PAYMENT занять. Заняття на today лишаються запланованими.
+    Повертає {"children": [ID], "lessons": n, "payments": n}.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    first_day = today - timedelta(weeks=round(52 * years))
+    last_day = today + timedelta(weeks=future_weeks)
+    period_days = (today - first_day).days
+
+    child_ids = []
+    lessons_total = 0
+    payments_total = 0
+    for index in range(children):
+        base_price = rng.choice(BASE_PRICES)
+        child_id = await store.add_child(user_id, f"Дитина {index + 1}", rng.randint(5, 15), base_price)
+        child_ids.append(child_id)
+
+        # Діти рівномірно розподілені по днях тижня та годинах 09:00-18:55
+        hour = 9 + index % 10
+        lessons = []
+        day = first_day + timedelta(days=index % 7)
+        while day <= last_day:
+            lessons.append({
+                "user_id": user_id,
+                "child_id": str(child_id),
+                "date": day.isoformat(),
+                "start_time": f"{hour:02d}:00",
+                "end_time": f"{hour:02d}:55"
+            })
+            day += timedelta(weeks=1)
+        # Слоти дитини не перетинаються, тож створюються всі заняття в порядку списку
+        inserted_ids, _, _ = await store.add_lessons_bulk(lessons)
+        lessons_total += len(inserted_ids)
+
+        paid_lessons = 0
+        for lesson_id, lesson in zip(inserted_ids, lessons):
+            if lesson["date"] >= today.isoformat():
+                continue
+            roll = rng.random()
+            if roll < cancelled_ratio:
+                await store.mark_lesson_cancelled(lesson_id)
+            elif roll < cancelled_ratio + completed_ratio:
+                await store.mark_lesson_completed(lesson_id)
+                if rng.random() < paid_ratio:
+                    await store.mark_lesson_paid(lesson_id)
+                    paid_lessons += 1
+
+        # Оплати рівномірно розподілені по періоду
+        payments = paid_lessons // LESSONS_PER_PAYMENT
+        for number in range(1, payments + 1):
+            payment_day = first_day + timedelta(days=period_days * number // (payments + 1))
+            await store.add_payment(
+                user_id, str(child_id), LESSONS_PER_PAYMENT * base_price, LESSONS_PER_PAYMENT,
+                payment_day.isoformat()
+            )
+        payments_total += payments
+
+    return {"children": child_ids, "lessons": lessons_total, "payments": payments_total}
@@ -0,0 +1,65 @@
+"""Мінімальні замінники Update/CallbackQuery/Context з тими атрибутами, які використовують обробники"""
+
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str = "Benchmark", username: str = "benchmark"):
+        self.id = user_id
+        self.first_name = first_name
+        self.username = username
+
+
+class FakeMessage:
+    """Повідомлення, що запам'ятовує відповіді бота замість надсилання"""
+
+    def __init__(self, text: str = "", from_user: FakeUser = None):
+        self.text = text
+        self.from_user = from_user
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+        return FakeMessage(text)
+
+
+class FakeCallbackQuery:
+    """Натискання кнопки: answer нічого не робить, edit_message_text змінює текст повідомлення"""
+
+    def __init__(self, data: str, from_user: FakeUser, message: FakeMessage = None):
+        self.data = data
+        self.from_user = from_user
+        self.message = message or FakeMessage(from_user=from_user)
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text: str, **kwargs):
+        self.message.text = text
+        return self.message
+
+
+class FakeUpdate:
+    def __init__(self, user: FakeUser, message: FakeMessage = None, callback_query: FakeCallbackQuery = None):
+        self.effective_user = user
+        self.message = message
+        self.callback_query = callback_query
+        self.effective_message = message or (callback_query.message if callback_query else None)
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data = {}
+        self.chat_data = {}
+        self.bot_data = {}
+        self.args = []
+
+
+def command_update(user_id: int, text: str) -> FakeUpdate:
+    """Оновлення з командою або текстовим повідомленням"""
+    user = FakeUser(user_id)
+    return FakeUpdate(user, message=FakeMessage(text, from_user=user))
+
+
+def callback_update(user_id: int, data: str) -> FakeUpdate:
+    """Оновлення з натисканням inline-кнопки"""
+    user = FakeUser(user_id)
+    return FakeUpdate(user, callback_query=FakeCallbackQuery(data, user))
@@ -0,0 +1,273 @@
+"""
+Офлайн навантажувальний тест: справжній Application з main.build_application(), Bot API
+замінено заглушкою без мережі, дані - у сховищі в пам'яті.
+
+    python -m benchmarks.load_test --users 200 --rounds 3 --children 50 --api-latency-ms 30
+
+Кожен користувач послідовно (як живий користувач, що чекає відповіді) проходить сценарій:
+команди, кнопки розкладу, позначення занять, звіти та діалог додавання заняття;
+користувачі працюють паралельно. Оновлення проходять той самий шлях, що й при polling:
+update_processor.process_update(update, application.process_update(update)), тож діють
+обмеження CONCURRENT_UPDATES (--concurrency) та черговість оновлень кожного користувача.
+Звіт: пропускна здатність, перцентилі латентності оновлень і затримка event loop
+(з кількістю замірів: кілька замірів на весь прогін означають, що loop майже не звільнявся).
+"""
+from benchmarks import BENCHMARK_USER_ID
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from telegram.request import BaseRequest
+
+# ID бота-заглушки
+STUB_BOT_ID = 1000000
+
+
+class StubBotRequest(BaseRequest):
+    """
+    Bot API без мережі: відповідає на getMe, sendMessage, editMessageText та інші методи
+    правдоподібними JSON-відповідями після затримки latency (секунди), що імітує мережу.
+    Навіть з latency=0 кожен запит віддає керування event loop, як справжній мережевий виклик,
+    інакше оновлення різних користувачів виконувались би строго по черзі.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, parameters: dict) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": parameters.get("message_id") or self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(parameters.get("chat_id") or 0), "type": "private"},
+            "from": {"id": STUB_BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+            "text": parameters.get("text", "")
+        }
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": STUB_BOT_ID, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = self._message(parameters)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class UpdateFactory:
+    """Синтетичні оновлення у форматі Bot API (Update.de_json) від імені користувачів"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": self._next_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def message(self, user_id: int, text: str):
+        from telegram import Update
+        return Update.de_json({"update_id": self._next_id(), "message": self._message(user_id, text)}, self.bot)
+
+    def callback(self, user_id: int, data: str, message_text: str = ""):
+        from telegram import Update
+        message = self._message(user_id, message_text)
+        message["from"] = {"id": STUB_BOT_ID, "is_bot": True, "first_name": "LoadTest"}
+        return Update.de_json({
+            "update_id": self._next_id(),
+            "callback_query": {
+                "id": str(self._next_id()),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": message
+            }
+        }, self.bot)
+
+
+def user_script(factory: UpdateFactory, user_id: int, child_ids: list, today_lesson_ids: list):
+    """Послідовність оновлень одного користувача за один раунд"""
+    child_id = child_ids[user_id % len(child_ids)]
+    tomorrow = (date.today() + timedelta(days=1)).strftime("%d.%m.%Y")
+    # Час нового заняття різний для різних користувачів, щоб не впиратися в унікальність слоту
+    start = datetime(2000, 1, 1, 7 + user_id % 14, (user_id * 5) % 60)
+    end = start + timedelta(minutes=55)
+
+    script = [
+        factory.message(user_id, "/start"),
+        factory.message(user_id, "/timetable"),
+        factory.callback(user_id, "timetable_week"),
+        factory.callback(user_id, "timetable_tomorrow"),
+    ]
+    if today_lesson_ids:
+        lesson_id = today_lesson_ids[user_id % len(today_lesson_ids)]
+        script += [
+            factory.callback(user_id, f"mark_{lesson_id}"),
+            factory.callback(user_id, f"unmark_{lesson_id}"),
+        ]
+    script += [
+        factory.message(user_id, "/balance"),
+        factory.callback(user_id, f"balance_child_{child_id}"),
+        factory.message(user_id, "/dashboard"),
+        factory.callback(user_id, "dashboard_by_days"),
+        # Діалог додавання заняття з плануванням на місяць вперед
+        factory.message(user_id, "/addlesson"),
+        factory.callback(user_id, f"lesson_child_{child_id}"),
+        factory.callback(user_id, f"date_{tomorrow}"),
+        factory.message(user_id, start.strftime("%H:%M")),
+        factory.callback(user_id, f"endtime_{end.strftime('%H:%M')}"),
+        factory.callback(user_id, "repeat_monthly_yes"),
+        factory.callback(user_id, "confirm_monthly_yes"),
+        factory.message(user_id, "Дякую!"),
+    ]
+    return script
+
+
+def _percentile(values: list, q: float) -> float:
+    """Перцентиль вже відсортованого списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _monitor_loop_lag(lags: list, stop: asyncio.Event, interval: float = 0.01):
+    """Затримка event loop: наскільки пізніше запланованого прокидається sleep(interval)"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run(users: int, rounds: int, children: int, years: float, api_latency: float, seed: int = 0):
+    """Навантажувальний тест; повертає зведення результатів"""
+    # Імпорт після налаштування середовища в main(): Config читає змінні при імпорті
+    from database import db
+    from main import build_application
+    from benchmarks.dataset import generate_dataset
+
+    application = build_application(request=StubBotRequest(latency=api_latency))
+    errors = []
+
+    async def count_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(count_error)
+
+    async with application:
+        await application.post_init(application)
+        dataset = await generate_dataset(db, BENCHMARK_USER_ID, children=children, years=years, seed=seed)
+        today = date.today().isoformat()
+        today_lesson_ids = [str(lesson["_id"]) for lesson in await db.get_lessons_in_range(today, today)]
+        child_ids = [str(child_id) for child_id in dataset["children"]]
+
+        factory = UpdateFactory(application.bot)
+        latencies = []
+
+        async def process(update):
+            # Той самий шлях, що й Application при отриманні оновлення з update_queue
+            started = time.perf_counter()
+            await application.update_processor.process_update(update, application.process_update(update))
+            latencies.append(time.perf_counter() - started)
+
+        async def simulate_user(user_id: int):
+            for _ in range(rounds):
+                for update in user_script(factory, user_id, child_ids, today_lesson_ids):
+                    await process(update)
+
+        lags = []
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(_monitor_loop_lag(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(user_id) for user_id in range(1, users + 1)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await monitor
+        await application.post_shutdown(application)
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "users": users,
+        "updates": len(latencies),
+        "errors": len(errors),
+        "concurrent_updates": application.concurrent_updates,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            **{f"p{int(q * 100)}": _percentile(latencies, q) * 1000 for q in (0.5, 0.9, 0.99)},
+            "max": latencies[-1] * 1000 if latencies else 0.0
+        },
+        "loop_lag_ms": {
+            **{f"p{int(q * 100)}": _percentile(lags, q) * 1000 for q in (0.5, 0.99)},
+            "max": lags[-1] * 1000 if lags else 0.0
+        },
+        "loop_lag_samples": len(lags),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн навантажувальний тест бота")
+    parser.add_argument("--users", type=int, default=100, help="кількість паралельних користувачів")
+    parser.add_argument("--rounds", type=int, default=2, help="скільки разів кожен користувач проходить сценарій")
+    parser.add_argument("--children", type=int, default=30, help="кількість дітей у синтетичних даних")
+    parser.add_argument("--years", type=float, default=1, help="роки історії занять")
+    parser.add_argument("--concurrency", type=int, help="CONCURRENT_UPDATES (за замовчуванням - з конфігурації)")
+    parser.add_argument("--api-latency-ms", type=float, default=20, help="імітована затримка Bot API, мс")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора даних")
+    parser.add_argument("--json", help="файл для збереження результатів")
+    args = parser.parse_args()
+
+    # Усі синтетичні користувачі мають доступ до бота
+    os.environ["ALLOWED_USER_IDS"] = ",".join(str(user_id) for user_id in range(1, max(args.users, 1) + 1))
+    if args.concurrency:
+        os.environ["CONCURRENT_UPDATES"] = str(args.concurrency)
+    logging.basicConfig(level=logging.WARNING)
+
+    result = asyncio.run(run(
+        args.users, args.rounds, args.children, args.years, args.api_latency_ms / 1000, seed=args.seed
+    ))
+    print(
+        f"Оновлень: {result['updates']} від {result['users']} користувачів за {result['seconds']:.2f} с "
+        f"(concurrent_updates={result['concurrent_updates']}), помилок: {result['errors']}\n"
+        f"Пропускна здатність: {result['throughput']:.0f} оновлень/с\n"
+        "Латентність, мс: " + ", ".join(f"{k}={v:.1f}" for k, v in result["latency_ms"].items()) + "\n"
+        "Затримка event loop, мс: " + ", ".join(f"{k}={v:.1f}" for k, v in result["loop_lag_ms"].items())
+        + f" ({result['loop_lag_samples']} замірів)"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
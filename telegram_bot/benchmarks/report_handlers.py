@@ -0,0 +1,124 @@
+"""
+Бенчмарк звітних обробників на синтетичних даних у сховищі в пам'яті:
+
+    python -m benchmarks.report_handlers --children 10 50 200 --years 1 3 --repeat 20 --json results.json
+
+Для кожного розміру даних і обробника: медіана та p95 часу виклику, пік виділеної
+пам'яті (tracemalloc) та кількість викликів сховища на один виклик обробника.
+"""
+from benchmarks import BENCHMARK_USER_ID
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+import tracemalloc
+import handlers.lessons as lessons
+from benchmarks.dataset import generate_dataset
+from benchmarks.fakes import FakeContext, callback_update, command_update
+from db_metrics import DB_CALL_SECONDS
+from memory_storage import MemoryDatabase
+
+
+def _scenarios(child_id: str):
+    """Пари (назва, фабрика корутини) - кожен виклик отримує свіжі Update та Context"""
+    user_id = BENCHMARK_USER_ID
+    return [
+        ("balance_command", lambda: lessons.balance_command(command_update(user_id, "/balance"), FakeContext())),
+        ("handle_balance_button", lambda: lessons.handle_balance_button(
+            callback_update(user_id, f"balance_child_{child_id}"), FakeContext()
+        )),
+        ("dashboard_command", lambda: lessons.dashboard_command(command_update(user_id, "/dashboard"), FakeContext())),
+        ("handle_dashboard_button:by_days", lambda: lessons.handle_dashboard_button(
+            callback_update(user_id, "dashboard_by_days"), FakeContext()
+        )),
+        ("handle_dashboard_button:by_children", lambda: lessons.handle_dashboard_button(
+            callback_update(user_id, "dashboard_by_children"), FakeContext()
+        )),
+        ("timetable_command", lambda: lessons.timetable_command(command_update(user_id, "/timetable"), FakeContext())),
+        ("show_week_timetable", lambda: lessons.show_week_timetable(
+            callback_update(user_id, "timetable_week").callback_query, user_id
+        )),
+    ]
+
+
+def _db_calls() -> int:
+    """Загальна кількість викликів методів сховища (db_metrics)"""
+    return sum(state["count"] for _, state in DB_CALL_SECONDS.snapshot())
+
+
+async def _measure(factory, repeat: int) -> dict:
+    """Прогрів, підрахунок викликів сховища, пік пам'яті та repeat замірів часу"""
+    await factory()
+
+    calls_before = _db_calls()
+    await factory()
+    db_calls = _db_calls() - calls_before
+
+    # Пам'ять міряється окремим викликом: tracemalloc суттєво сповільнює виконання
+    tracemalloc.start()
+    await factory()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await factory()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "peak_kib": peak / 1024,
+        "db_calls": db_calls
+    }
+
+
+async def run(children_sizes, years_list, repeat: int = 20, seed: int = 0):
+    """Всі сценарії для кожної комбінації кількості дітей та років історії"""
+    results = []
+    print(f"{'обробник':<38}{'дітей':>7}{'років':>7}{'занять':>9}{'медіана, мс':>13}{'p95, мс':>10}"
+          f"{'пам., КіБ':>11}{'викл. БД':>10}")
+    for years in years_list:
+        for children in children_sizes:
+            store = MemoryDatabase()
+            await store.connect()
+            # Обробники звертаються до глобального database.db, імпортованого в handlers.lessons
+            lessons.db = store
+            dataset = await generate_dataset(store, BENCHMARK_USER_ID, children=children, years=years, seed=seed)
+
+            for name, factory in _scenarios(str(dataset["children"][0])):
+                result = {
+                    "scenario": name,
+                    "children": children,
+                    "years": years,
+                    "lessons": dataset["lessons"],
+                    "payments": dataset["payments"],
+                    **await _measure(factory, repeat)
+                }
+                results.append(result)
+                print(f"{name:<38}{children:>7}{years:>7g}{result['lessons']:>9}{result['median_ms']:>13.2f}"
+                      f"{result['p95_ms']:>10.2f}{result['peak_kib']:>11.1f}{result['db_calls']:>10}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк звітних обробників на синтетичних даних")
+    parser.add_argument("--children", type=int, nargs="+", default=[10, 50, 200], help="кількість дітей")
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 3], help="роки історії занять")
+    parser.add_argument("--repeat", type=int, default=20, help="кількість замірів на сценарій")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора даних")
+    parser.add_argument("--json", help="файл для збереження результатів (для порівняння між версіями)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args.children, args.years, repeat=max(args.repeat, 1), seed=args.seed))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
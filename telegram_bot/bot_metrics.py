@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Метрики обробки оновлень
+HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds",
+    "Тривалість обробки оновлення за командою або префіксом callback",
+    ("handler",)
+)
+UPDATES_IN_FLIGHT = Gauge(
+    "bot_updates_in_flight",
+    "Оновлення, що обробляються зараз"
+)
+
+# Метрики запитів до Telegram Bot API
+TELEGRAM_API_SECONDS = Histogram(
+    "telegram_api_request_duration_seconds",
+    "Тривалість запитів до Telegram Bot API",
+    ("method",)
+)
+TELEGRAM_API_ERRORS = Counter(
+    "telegram_api_request_errors_total",
+    "Запити до Telegram Bot API, що завершились помилкою мережі або таймаутом",
+    ("method",)
+)
+
+# Префікси callback_data з власними обробниками в main.py; решту обробляє settings_callback
+CALLBACK_PREFIXES = ("timetable_", "mark_", "unmark_", "cancel_", "uncancel_", "balance_", "dashboard_")
+
+
+def _collect_commands(handlers):
+    """Команди всіх CommandHandler, включно з вкладеними в ConversationHandler"""
+    commands = set()
+    for handler in handlers:
+        if isinstance(handler, CommandHandler):
+            commands.update(handler.commands)
+        elif isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            commands.update(_collect_commands(nested))
+    return commands
+
+
+def update_label(update, commands) -> str:
+    """
+    Мітка оновлення з обмеженою кількістю значень: "/команда" (лише зареєстровані),
+    префікс callback з CALLBACK_PREFIXES, "settings" для решти callback, "message" або "other".
+    """
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query:
+        prefix = (update.callback_query.data or "").split("_", 1)[0] + "_"
+        return prefix if prefix in CALLBACK_PREFIXES else "settings"
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        command = message.text.split()[0][1:].split("@")[0].lower()
+        return f"/{command}" if command in commands else "/other"
+    return "message"
+
+
+class MetricsApplication(Application):
+    """Application, що рахує тривалість обробки кожного оновлення та кількість оновлень в обробці"""
+
+    __slots__ = ("_known_commands",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._known_commands = None
+
+    async def process_update(self, update: object) -> None:
+        if self._known_commands is None:
+            # Обробники реєструються до запуску, тож список команд збирається один раз
+            self._known_commands = _collect_commands(
+                handler for handlers in self.handlers.values() for handler in handlers
+            )
+        label = update_label(update, self._known_commands)
+        UPDATES_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await super().process_update(update)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=label)
+            UPDATES_IN_FLIGHT.dec()
+
+
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest з вимірюванням тривалості запитів до Bot API за методом"""
+
+    __slots__ = ()
+
+    @staticmethod
+    def _api_method(url: str) -> str:
+        # Завантаження файлів: .../file/bot<token>/<шлях> - шлях у мітку не потрапляє
+        if "/file/bot" in url:
+            return "file"
+        return url.rsplit("/", 1)[-1]
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = self._api_method(url)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(method=api_method)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+
+
+class MetricsServer:
+    """Мінімальний HTTP-сервер, що віддає REGISTRY у форматі Prometheus на GET /metrics"""
+
+    def __init__(self, host: str, port: int, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self._registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Метрики доступні на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запиту не потрібні, але їх треба дочитати до порожнього рядка
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) > 1 else ""
+            if parts and parts[0] == "GET" and path in ("/", "/metrics"):
+                status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                body = self._registry.render().encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,20 +1,96 @@
 import os
+import re
 from dotenv import load_dotenv
 
 # Завантаження змінних з .env файлу
 load_dotenv()
 
 
+def _optional_int(name: str):
+    """Ціле число зі змінної середовища або None, якщо її не задано"""
+    value = os.getenv(name, '').strip()
+    return int(value) if value else None
+
+
 class Config:
     """Конфігурація бота"""
 
     # Telegram Bot Token
     BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+    # Сховище: mongodb (Database) або memory (MemoryDatabase, дані лише в пам'яті процесу)
+    DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'mongodb').strip().lower()
+
+    # Режим отримання оновлень: polling або webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+    # Webhook: публічна адреса (https://bot.example.com), шлях, адреса й порт вбудованого сервера
+    # та секрет, який Telegram надсилає в заголовку X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip().rstrip('/')
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram').strip().strip('/')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '').strip()
+    # Максимальна кількість одночасних з'єднань Telegram з webhook (1-100)
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+    # Скільки оновлень може бути прийнято й ще не оброблено (в черзі та в обробці); далі прийом чекає на обробку
+    UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+    # Скільки оновлень обробляється одночасно (оновлення одного користувача - завжди по черзі)
+    CONCURRENT_UPDATES = max(1, int(os.getenv('CONCURRENT_UPDATES', '16')))
+
     # MongoDB
     MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
     MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'telegram_bot_db')
 
+    # MongoDB: пул з'єднань, стиснення та таймаути (None - значення драйвера за замовчуванням)
+    MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '100'))
+    MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+    MONGODB_MAX_IDLE_TIME_MS = _optional_int('MONGODB_MAX_IDLE_TIME_MS')
+    # Через кому, в порядку пріоритету: zstd (потрібен zstandard), snappy (python-snappy), zlib
+    MONGODB_COMPRESSORS = [
+        compressor.strip()
+        for compressor in os.getenv('MONGODB_COMPRESSORS', '').split(',')
+        if compressor.strip()
+    ]
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '30000'))
+    MONGODB_SOCKET_TIMEOUT_MS = _optional_int('MONGODB_SOCKET_TIMEOUT_MS')
+
+    # Виконувати складені операції (complete_and_roll_forward) в транзакції.
+    # Потрібен replica set або sharded cluster; без цього - лише спільна сесія
+    MONGODB_USE_TRANSACTIONS = os.getenv('MONGODB_USE_TRANSACTIONS', 'false').strip().lower() in ('1', 'true', 'yes')
+
+    # Буферизоване логування повідомлень: розмір пачки, інтервал запису (сек)
+    # та максимальна кількість записів у буфері (далі log_message чекає на запис)
+    MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', '100'))
+    MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv('MESSAGE_LOG_FLUSH_INTERVAL', '2'))
+    MESSAGE_LOG_MAX_PENDING = int(os.getenv('MESSAGE_LOG_MAX_PENDING', '10000'))
+    # Скільки днів зберігати логи повідомлень (0 - зберігати назавжди)
+    MESSAGE_LOG_RETENTION_DAYS = int(os.getenv('MESSAGE_LOG_RETENTION_DAYS', '90'))
+
+    # Режим сумісності з датами/часом у старому рядковому форматі ("YYYY-MM-DD", "HH:MM"):
+    # запити враховують обидва формати. Вимкнути після завершення міграції (/migratedates)
+    DATE_ENCODING_COMPAT = os.getenv('DATE_ENCODING_COMPAT', 'true').strip().lower() in ('1', 'true', 'yes')
+    # Кількість документів в одній пачці міграції
+    DATE_MIGRATION_BATCH_SIZE = int(os.getenv('DATE_MIGRATION_BATCH_SIZE', '500'))
+
+    # Розмір пачки документів для потокового читання (Database.iter_*)
+    CURSOR_BATCH_SIZE = int(os.getenv('CURSOR_BATCH_SIZE', '500'))
+
+    # Метрики викликів сховища та команд MongoDB (db_metrics.py, /dbstats)
+    DB_INSTRUMENTATION = os.getenv('DB_INSTRUMENTATION', 'true').strip().lower() in ('1', 'true', 'yes')
+    # Поріг (мс), після якого виклик або запит логується як повільний
+    DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+    # Розмір відповідей MongoDB у байтах: кожна відповідь серіалізується повторно, тому вимкнено за замовчуванням
+    DB_REPLY_BYTES = os.getenv('DB_REPLY_BYTES', 'false').strip().lower() in ('1', 'true', 'yes')
+
+    # HTTP-ендпоінт метрик Prometheus (GET /metrics); METRICS_PORT=0 - вимкнути
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+    # Максимальна кількість дітей у кеші в пам'яті (0 - вимкнути кеш)
+    CHILDREN_CACHE_SIZE = int(os.getenv('CHILDREN_CACHE_SIZE', '1000'))
+    # Максимальна кількість записів у кеші занять на день (0 - вимкнути кеш)
+    LESSON_CACHE_SIZE = int(os.getenv('LESSON_CACHE_SIZE', '256'))
+
     # Admin IDs
     ADMIN_IDS = [
         int(admin_id.strip())
@@ -43,3 +119,13 @@ class Config:
 # Валідація конфігурації
 if not Config.BOT_TOKEN:
     raise ValueError("BOT_TOKEN не знайдено в .env файлі!")
+
+if Config.BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Невідомий BOT_MODE={Config.BOT_MODE} (очікується polling або webhook)")
+
+if Config.BOT_MODE == 'webhook':
+    if not Config.WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook потрібен WEBHOOK_URL!")
+    # Telegram дозволяє в секреті лише A-Z, a-z, 0-9, _ та -, довжиною 1-256
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', Config.WEBHOOK_SECRET_TOKEN):
+        raise ValueError("Для BOT_MODE=webhook потрібен WEBHOOK_SECRET_TOKEN (1-256 символів A-Z, a-z, 0-9, _, -)")
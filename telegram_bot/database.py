@@ -1,23 +1,235 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ConnectionFailure
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from config import Config
+from db_metrics import CommandMetricsListener, instrument_storage
+from metrics import Gauge, Histogram, Counter
+from models import Child, Lesson, Payment
+from storage import LEGACY_LESSON_FIELDS, LEGACY_PAYMENT_FIELDS, StorageBackend
+from utils.dates import date_to_day, day_to_date
+import asyncio
 import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Метрики пулу з'єднань MongoDB
+MONGO_POOL_CHECKOUT_SECONDS = Histogram(
+    "mongodb_pool_checkout_wait_seconds",
+    "Час очікування вільного з'єднання з пулу MongoDB",
+    ("address",)
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total",
+    "Невдалі спроби отримати з'єднання з пулу MongoDB",
+    ("address", "reason")
+)
+MONGO_POOL_IN_USE = Gauge(
+    "mongodb_pool_connections_in_use",
+    "Кількість з'єднань MongoDB, виданих з пулу",
+    ("address",)
+)
+MONGO_POOL_OPEN = Gauge(
+    "mongodb_pool_connections_open",
+    "Кількість відкритих з'єднань MongoDB",
+    ("address",)
+)
 
-class Database:
-    """Клас для роботи з MongoDB"""
+# Метрики кешу занять на день
+LESSON_CACHE_REQUESTS = Counter(
+    "lesson_day_cache_requests_total",
+    "Звернення до кешу занять на день",
+    ("result",)
+)
+
+
+# Сигнал зупинки для фонового запису логів повідомлень
+_STOP_MESSAGE_LOG = object()
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Збір метрик пулу з'єднань MongoDB (події надходять з потоків драйвера)"""
+
+    def __init__(self):
+        # Видача з'єднання починається і завершується в одному потоці
+        self._local = threading.local()
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _observe_wait(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is not None:
+            MONGO_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started, address=self._address(event))
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._observe_wait(event)
+        MONGO_POOL_IN_USE.inc(address=self._address(event))
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait(event)
+        MONGO_POOL_CHECKOUT_FAILURES.inc(address=self._address(event), reason=event.reason)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.dec(address=self._address(event))
+
+    def connection_created(self, event):
+        MONGO_POOL_OPEN.inc(address=self._address(event))
+
+    def connection_closed(self, event):
+        MONGO_POOL_OPEN.dec(address=self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+# Реєстр індексів: колекція -> індекси, які мають існувати.
+# Застосовується в Database.connect() і створює тільки відсутні індекси.
+INDEXES = {
+    "lessons": [
+        # Розклад на день/тиждень та звіти за період
+        IndexModel(
+            [("user_id", ASCENDING), ("day", ASCENDING), ("start_min", ASCENDING)],
+            name="user_day_start"
+        ),
+        # Баланс дитини, перевірка використання дитини та останнє заплановане заняття
+        IndexModel(
+            [("child_id", ASCENDING), ("completed", ASCENDING), ("cancelled", ASCENDING),
+             ("day", ASCENDING), ("start_min", ASCENDING)],
+            name="child_status_day"
+        ),
+        # Одне заняття дитини на один день і час початку: повторне автопланування
+        # знаходить вже існуюче заняття замість створення дубліката.
+        # Ще не перекодовані документи (без day) обмеження не стосується
+        IndexModel(
+            [("child_id", ASCENDING), ("day", ASCENDING), ("start_min", ASCENDING)],
+            name="child_day_start_unique",
+            unique=True,
+            partialFilterExpression={"day": {"$exists": True}}
+        ),
+    ],
+    "payments": [
+        IndexModel(
+            [("child_id", ASCENDING), ("payment_day", ASCENDING)],
+            name="child_payment_day"
+        ),
+    ],
+    "monthly_rollups": [
+        IndexModel(
+            [("month", ASCENDING), ("child_id", ASCENDING), ("day", ASCENDING)],
+            name="month_child_day_unique",
+            unique=True
+        ),
+    ],
+    "child_balances": [
+        IndexModel([("child_id", ASCENDING)], name="child_unique", unique=True),
+    ],
+    "children": [
+        IndexModel(
+            [("user_id", ASCENDING), ("archived", ASCENDING), ("created_at", ASCENDING)],
+            name="user_archived_created"
+        ),
+    ],
+    "messages": [
+        # Історія повідомлень користувача з keyset-пагінацією по _id
+        IndexModel([("user_id", ASCENDING), ("_id", DESCENDING)], name="user_id_desc"),
+    ],
+}
+
+# Індекси, вимкнені в конфігурації або замінені іншими: Database.connect() видаляє їх,
+# якщо вони лишились з попереднього запуску
+OBSOLETE_INDEXES = {
+    # Замінений на child_status_day (той самий префікс, плюс day і start_min)
+    "lessons": ["child_status"],
+}
+
+# Поки не всі документи перекодовано, запити за датою йдуть і по старих рядкових полях;
+# після вимкнення DATE_ENCODING_COMPAT ці індекси лише сповільнюють запис
+if Config.DATE_ENCODING_COMPAT:
+    INDEXES["lessons"].append(IndexModel(
+        [("user_id", ASCENDING), ("date", ASCENDING), ("start_time", ASCENDING)],
+        name="user_date_start"
+    ))
+    INDEXES["payments"].append(IndexModel(
+        [("child_id", ASCENDING), ("payment_date", ASCENDING)],
+        name="child_payment_date"
+    ))
+else:
+    OBSOLETE_INDEXES.setdefault("lessons", []).append("user_date_start")
+    OBSOLETE_INDEXES.setdefault("payments", []).append("child_payment_date")
+
+# Логи старші за MESSAGE_LOG_RETENTION_DAYS видаляє сам MongoDB (TTL-індекс);
+# з 0 ("зберігати назавжди") індекс видаляється, інакше логи продовжували б зникати
+if Config.MESSAGE_LOG_RETENTION_DAYS > 0:
+    INDEXES["messages"].append(IndexModel(
+        [("timestamp", ASCENDING)],
+        name="timestamp_ttl",
+        expireAfterSeconds=Config.MESSAGE_LOG_RETENTION_DAYS * 24 * 60 * 60
+    ))
+else:
+    OBSOLETE_INDEXES.setdefault("messages", []).append("timestamp_ttl")
+
+
+@instrument_storage
+class Database(StorageBackend):
+    """Сховище в MongoDB (Motor)"""
 
     def __init__(self):
         self.client = None
         self.db = None
+        # Кеш дітей: str(_id) -> документ, найстаріші записи витісняються першими
+        self._children_cache = OrderedDict()
+        # True, коли в кеші всі діти і списки можна віддавати без запиту до БД
+        self._children_cache_complete = False
+        # Кеш занять на день: (day, child_id, status) -> документи, найстаріші записи витісняються першими
+        self._lesson_day_cache = OrderedDict()
+        # Зростає при кожній інвалідації: результат запиту, під час якого змінились заняття, не кешується
+        self._lesson_day_cache_version = 0
+        # Буфер логів повідомлень та фонове завдання, що записує його пачками
+        self._message_queue = None
+        self._message_flusher = None
 
     async def connect(self):
         """Підключення до MongoDB"""
         try:
-            self.client = AsyncIOMotorClient(Config.MONGODB_URI, tlsAllowInvalidCertificates=True)
+            client_options = {
+                "maxPoolSize": Config.MONGODB_MAX_POOL_SIZE,
+                "minPoolSize": Config.MONGODB_MIN_POOL_SIZE,
+                "maxIdleTimeMS": Config.MONGODB_MAX_IDLE_TIME_MS,
+                "serverSelectionTimeoutMS": Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                "socketTimeoutMS": Config.MONGODB_SOCKET_TIMEOUT_MS,
+                "event_listeners": [PoolMetricsListener()],
+            }
+            if Config.DB_INSTRUMENTATION:
+                client_options["event_listeners"].append(CommandMetricsListener())
+            if Config.MONGODB_COMPRESSORS:
+                client_options["compressors"] = Config.MONGODB_COMPRESSORS
+
+            self.client = AsyncIOMotorClient(
+                Config.MONGODB_URI,
+                tlsAllowInvalidCertificates=True,
+                **client_options
+            )
             self.db = self.client[Config.MONGODB_DB_NAME]
             # Перевірка підключення
             await self.client.admin.command('ping')
@@ -26,8 +238,218 @@ class Database:
             logger.error(f"❌ Помилка підключення до MongoDB: {e}")
             raise
 
+        await self.ensure_indexes()
+        await self.check_date_encoding()
+        self._start_message_logger()
+
+    async def ensure_indexes(self):
+        """Створення відсутніх індексів з реєстру INDEXES та видалення OBSOLETE_INDEXES (ідемпотентно)"""
+        for collection_name, names in OBSOLETE_INDEXES.items():
+            collection = self.db[collection_name]
+            existing = await collection.index_information()
+            for name in names:
+                if name not in existing:
+                    continue
+                try:
+                    await collection.drop_index(name)
+                    logger.info(f"📇 Видалено індекс {collection_name}.{name}, вимкнений у конфігурації")
+                except OperationFailure as e:
+                    logger.error(f"❌ Не вдалося видалити індекс {collection_name}.{name}: {e}")
+
+        for collection_name, indexes in INDEXES.items():
+            collection = self.db[collection_name]
+            existing = await collection.index_information()
+
+            for index in indexes:
+                name = index.document["name"]
+                if name in existing:
+                    await self._sync_index_ttl(collection_name, index, existing[name])
+                    continue
+                try:
+                    await collection.create_indexes([index])
+                    logger.info(f"📇 Створено індекс {collection_name}.{name}")
+                except OperationFailure as e:
+                    # Бот працює і без індексу, але запити будуть повільнішими
+                    logger.error(f"❌ Індекс {collection_name}.{name} відсутній, не вдалося створити: {e}")
+                    if e.code == 11000:
+                        logger.error("Унікальний індекс не створено через дублікати - запустіть /migratedates")
+
+            present = [index.document["name"] for index in indexes if index.document["name"] in existing]
+            if present:
+                logger.info(f"Індекси {collection_name} вже існують: {', '.join(present)}")
+
+    async def _sync_index_ttl(self, collection_name: str, index: IndexModel, existing: dict):
+        """Оновлення терміну зберігання TTL-індексу, якщо його змінили в конфігурації"""
+        expire_after = index.document.get("expireAfterSeconds")
+        if expire_after is None or existing.get("expireAfterSeconds") == expire_after:
+            return
+        name = index.document["name"]
+        try:
+            await self.db.command("collMod", collection_name, index={"name": name, "expireAfterSeconds": expire_after})
+            logger.info(f"📇 Оновлено TTL індексу {collection_name}.{name}: {expire_after} с")
+        except OperationFailure as e:
+            logger.error(f"❌ Не вдалося оновити TTL індексу {collection_name}.{name}: {e}")
+
+    async def backfill_message_timestamps(self):
+        """
+        Одноразове заповнення timestamp у старих логах з часу створення _id (інакше TTL їх не видалить).
+        Запускається з /migratedates; повертає кількість оновлених логів.
+        """
+        result = await self.db.messages.update_many(
+            {"timestamp": None},
+            [{"$set": {"timestamp": {"$toDate": "$_id"}}}]
+        )
+        if result.modified_count:
+            logger.info(f"Заповнено timestamp у {result.modified_count} логах повідомлень")
+        return result.modified_count
+
+    # === Кодування дат і часу (див. StorageBackend._decode_fields) ===
+
+    @staticmethod
+    def _legacy_filter(fields: dict) -> dict:
+        """Фільтр документів, у яких ще лишились рядкові поля старого формату"""
+        return {"$or": [{field: {"$exists": True}} for field in fields]}
+
+    @staticmethod
+    def _day_filter(field: str, legacy: str, start: str = None, end: str = None) -> dict:
+        """
+        Фільтр за діапазоном дат [start, end] (формат "YYYY-MM-DD") по числовому полю.
+        У режимі сумісності також знаходить ще не перекодовані документи за рядковим полем.
+        """
+        day_range, legacy_range = {}, {}
+        if start:
+            day_range["$gte"] = date_to_day(start)
+            legacy_range["$gte"] = start
+        if end:
+            day_range["$lte"] = date_to_day(end)
+            legacy_range["$lte"] = end
+        if not day_range:
+            return {}
+        if not Config.DATE_ENCODING_COMPAT:
+            return {field: day_range}
+        return {"$or": [
+            {field: day_range},
+            {field: {"$exists": False}, legacy: legacy_range}
+        ]}
+
+    async def check_date_encoding(self):
+        """Попередження, якщо режим сумісності вимкнено, а міграцію ще не завершено"""
+        if Config.DATE_ENCODING_COMPAT:
+            return
+        for collection_name, fields in (("lessons", LEGACY_LESSON_FIELDS), ("payments", LEGACY_PAYMENT_FIELDS)):
+            if await self.db[collection_name].find_one(self._legacy_filter(fields), {"_id": 1}):
+                logger.warning(
+                    f"⚠️ У {collection_name} є документи зі старим форматом дат, а DATE_ENCODING_COMPAT вимкнено. "
+                    f"Запустіть /migratedates"
+                )
+
+    async def migrate_date_encoding(self, batch_size: int = None):
+        """
+        Перекодування рядкових дат/часу в занятях та оплатах у числові поля пачками.
+        Міграцію можна переривати й запускати повторно: обробляються лише документи,
+        у яких ще лишились старі поля. Заняття, перекодований слот яких уже зайнятий
+        (індекс child_day_start_unique), розв'язуються як дублікати, див. _resolve_slot_conflict.
+        Повертає {колекція: кількість оновлених документів, "lesson_duplicates": видалені дублікати,
+        "lesson_conflicts": заняття, які не вдалося перекодувати через зайнятий слот}.
+        """
+        batch_size = batch_size or Config.DATE_MIGRATION_BATCH_SIZE
+        migrated = {"lesson_duplicates": 0, "lesson_conflicts": 0}
+        for collection_name, fields in (("lessons", LEGACY_LESSON_FIELDS), ("payments", LEGACY_PAYMENT_FIELDS)):
+            collection = self.db[collection_name]
+            query = self._legacy_filter(fields)
+            projection = {legacy: 1 for legacy in fields}
+            last_id = None
+            total = 0
+
+            while True:
+                batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+                cursor = collection.find(batch_query, projection).sort("_id", ASCENDING).limit(batch_size)
+                docs = await cursor.to_list(length=batch_size)
+                if not docs:
+                    break
+                # Наступна пачка починається після останнього переглянутого документа,
+                # тож документи з пошкодженими значеннями не обробляються по колу
+                last_id = docs[-1]["_id"]
+
+                updates = []
+                for doc in docs:
+                    encoded, unset = {}, {}
+                    try:
+                        for legacy, (field, encode, _) in fields.items():
+                            if legacy in doc:
+                                encoded[field] = encode(doc[legacy])
+                                unset[legacy] = ""
+                    except (TypeError, ValueError) as e:
+                        logger.error(f"❌ Не вдалося перекодувати {collection_name} {doc['_id']}: {e}")
+                        continue
+                    updates.append((doc["_id"], {"$set": encoded, "$unset": unset}))
+
+                if updates:
+                    requests = [UpdateOne({"_id": doc_id}, update) for doc_id, update in updates]
+                    try:
+                        result = await collection.bulk_write(requests, ordered=False)
+                        total += result.modified_count
+                    except BulkWriteError as e:
+                        # ordered=False: решта пачки записана, помилки - по окремих документах
+                        total += e.details.get("nModified", 0)
+                        for error in e.details.get("writeErrors", []):
+                            doc_id, update = updates[error["index"]]
+                            if collection_name != "lessons" or error.get("code") != 11000:
+                                logger.error(f"❌ Не вдалося перекодувати {collection_name} {doc_id}: {error.get('errmsg')}")
+                                continue
+                            outcome = await self._resolve_slot_conflict(doc_id, update)
+                            if outcome == "conflict":
+                                migrated["lesson_conflicts"] += 1
+                            else:
+                                migrated["lesson_duplicates"] += 1
+                                total += outcome == "migrated"
+                logger.info(f"Міграція дат {collection_name}: перекодовано {total} документів")
+
+            migrated[collection_name] = total
+        self._clear_lesson_cache()
+        return migrated
+
+    @staticmethod
+    def _duplicate_rank(lesson: dict):
+        """Порядок збереження дублікатів: спершу проведені/скасовані, далі найстаріші (як remove_duplicate_lessons)"""
+        scheduled = not (lesson.get("completed") or lesson.get("cancelled"))
+        return scheduled, lesson.get("created_at") or datetime.min
+
+    async def _resolve_slot_conflict(self, lesson_id, update: dict):
+        """
+        Заняття старого формату, перекодований слот якого вже зайнятий іншим заняттям (E11000).
+        З двох лишається проведене/скасоване або найстаріше, видаляється лише заплановане,
+        тож лічильники й зведення не змінюються. Повертає "migrated" (видалено заняття,
+        що займало слот, і це перекодовано), "removed" (видалено це заняття) або "conflict"
+        (обидва проведені/скасовані - потрібна ручна перевірка, заняття лишається в старому форматі).
+        """
+        legacy = self._decode_lesson(await self.db.lessons.find_one({"_id": lesson_id}))
+        if legacy is None:
+            return "removed"
+        slot = self._lesson_slot({**legacy, **update["$set"]})
+        existing = await self.db.lessons.find_one({**slot, "_id": {"$ne": lesson_id}})
+
+        if existing is not None:
+            keep, drop = sorted((legacy, existing), key=self._duplicate_rank)
+            if not self._duplicate_rank(drop)[0]:
+                logger.warning(f"⚠️ Кілька проведених/скасованих занять в одному слоті {slot}, потрібна ручна перевірка")
+                return "conflict"
+            await self.db.lessons.delete_one({"_id": drop["_id"]})
+            logger.info(f"Видалено дублікат заняття {drop['_id']} (слот {slot})")
+            if drop is legacy:
+                return "removed"
+
+        try:
+            await self.db.lessons.update_one({"_id": lesson_id}, update)
+        except OperationFailure as e:
+            logger.error(f"❌ Не вдалося перекодувати заняття {lesson_id}: {e}")
+            return "conflict"
+        return "migrated"
+
     async def disconnect(self):
         """Відключення від MongoDB"""
+        # Спочатку дописуємо в БД всі буферизовані логи
+        await self._stop_message_logger()
         if self.client:
             self.client.close()
             logger.info("MongoDB відключено")
@@ -55,22 +477,196 @@ class Database:
         cursor = self.db.users.find()
         return await cursor.to_list(length=None)
 
+    async def iter_users(self, batch_size: int = None):
+        """Потокове читання всіх користувачів пачками по batch_size (за замовчуванням CURSOR_BATCH_SIZE)"""
+        async for user in self.db.users.find().batch_size(batch_size or Config.CURSOR_BATCH_SIZE):
+            yield user
+
     # === Повідомлення/Логи ===
     async def log_message(self, user_id: int, message_text: str, message_type: str = "text"):
-        """Логування повідомлень"""
+        """Логування повідомлень (запис у БД відбувається у фоні пачками)"""
+        from bson.objectid import ObjectId
         log_data = {
+            # _id створюється одразу, тож порядок логів (пагінація по _id) не залежить від запису пачок
+            "_id": ObjectId(),
             "user_id": user_id,
             "message_text": message_text,
-            "message_type": message_type,
-            "timestamp": None  # MongoDB додасть timestamp автоматично
+            "message_type": message_type
         }
-        await self.db.messages.insert_one(log_data)
+        if self._message_queue is None:
+            await self.db.messages.bulk_write([self._message_log_insert(log_data)])
+            return
+        # Якщо буфер заповнений, чекаємо поки фонове завдання його розвантажить
+        await self._message_queue.put(log_data)
+
+    def _start_message_logger(self):
+        """Запуск фонового запису логів повідомлень"""
+        if self._message_flusher is not None:
+            return
+        self._message_queue = asyncio.Queue(maxsize=Config.MESSAGE_LOG_MAX_PENDING)
+        self._message_flusher = asyncio.create_task(self._run_message_flusher())
+
+    async def _stop_message_logger(self):
+        """Зупинка фонового запису з дописуванням усіх буферизованих логів"""
+        if self._message_flusher is None:
+            return
+        await self._message_queue.put(_STOP_MESSAGE_LOG)
+        await self._message_flusher
+        self._message_flusher = None
+        self._message_queue = None
 
-    async def get_user_messages(self, user_id: int, limit: int = 100):
-        """Отримання історії повідомлень користувача"""
-        cursor = self.db.messages.find({"user_id": user_id}).sort("_id", -1).limit(limit)
+    async def _run_message_flusher(self):
+        """Збирає логи в пачки до MESSAGE_LOG_BATCH_SIZE або MESSAGE_LOG_FLUSH_INTERVAL секунд"""
+        loop = asyncio.get_running_loop()
+        queue = self._message_queue
+        stopping = False
+
+        while not stopping:
+            entry = await queue.get()
+            if entry is _STOP_MESSAGE_LOG:
+                break
+
+            batch = [entry]
+            deadline = loop.time() + Config.MESSAGE_LOG_FLUSH_INTERVAL
+            while len(batch) < Config.MESSAGE_LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _STOP_MESSAGE_LOG:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            await self._write_message_batch(batch)
+
+    @staticmethod
+    def _message_log_insert(log_data: dict) -> UpdateOne:
+        """
+        Вставка логу з timestamp з годинника сервера MongoDB ($currentDate), від якого рахується TTL.
+        upsert по новому _id завжди створює документ.
+        """
+        return UpdateOne(
+            {"_id": log_data["_id"]},
+            {"$setOnInsert": {field: value for field, value in log_data.items() if field != "_id"},
+             "$currentDate": {"timestamp": True}},
+            upsert=True
+        )
+
+    async def _write_message_batch(self, batch: list):
+        """Запис пачки логів; помилка не повинна зупиняти фоновий запис"""
+        try:
+            await self.db.messages.bulk_write([self._message_log_insert(entry) for entry in batch], ordered=False)
+        except Exception as e:
+            logger.error(f"❌ Не вдалося записати {len(batch)} логів повідомлень: {e}")
+
+    async def get_user_messages(self, user_id: int, limit: int = 100, before_id: str = None):
+        """
+        Отримання історії повідомлень користувача (від новіших до старіших).
+        Для наступної сторінки передайте before_id=str(_id) останнього отриманого повідомлення.
+        """
+        from bson.objectid import ObjectId
+        query = {"user_id": user_id}
+        if before_id:
+            query["_id"] = {"$lt": ObjectId(before_id)}
+        cursor = self.db.messages.find(query).sort("_id", -1).limit(limit)
         return await cursor.to_list(length=limit)
 
+    # === Кеш дітей ===
+    async def load_children_cache(self):
+        """Завантаження всіх дітей у кеш (викликається з post_init)"""
+        self._children_cache.clear()
+        self._children_cache_complete = False
+
+        loaded = 0
+        async for child in self.db.children.find():
+            self._cache_child(child)
+            loaded += 1
+
+        self._children_cache_complete = 0 < Config.CHILDREN_CACHE_SIZE and loaded <= Config.CHILDREN_CACHE_SIZE
+        logger.info(f"Кеш дітей: завантажено {len(self._children_cache)} з {loaded}")
+
+    def _cache_child(self, child):
+        """Додавання дитини в кеш з витісненням найдавніше використаних записів"""
+        if Config.CHILDREN_CACHE_SIZE <= 0:
+            return
+        key = str(child['_id'])
+        self._children_cache[key] = child
+        self._children_cache.move_to_end(key)
+        while len(self._children_cache) > Config.CHILDREN_CACHE_SIZE:
+            self._children_cache.popitem(last=False)
+            # Після витіснення кеш вже не містить усіх дітей
+            self._children_cache_complete = False
+
+    def _get_cached_child(self, child_id):
+        """Копія дитини з кешу або None"""
+        key = str(child_id)
+        child = self._children_cache.get(key)
+        if child is None:
+            return None
+        self._children_cache.move_to_end(key)
+        return dict(child)
+
+    def _update_cached_child(self, child_id, update_data: dict):
+        """Застосування змін до дитини в кеші (якщо вона там є)"""
+        key = str(child_id)
+        if key in self._children_cache:
+            self._children_cache[key] = {**self._children_cache[key], **update_data}
+
+    def _filter_cached_children(self, archived: bool = None):
+        """Діти дозволених користувачів з кешу, відсортовані за датою створення"""
+        children = [
+            dict(child) for child in self._children_cache.values()
+            if child.get('user_id') in Config.ALLOWED_USER_IDS
+            and (archived is None or bool(child.get('archived', False)) == archived)
+        ]
+        children.sort(key=lambda child: child.get('created_at') or datetime.min)
+        return children
+
+    # === Кеш занять на день ===
+    def _get_cached_day_lessons(self, key: tuple):
+        """Копії занять дня з кешу або None"""
+        lessons = self._lesson_day_cache.get(key)
+        if lessons is None:
+            LESSON_CACHE_REQUESTS.inc(result="miss")
+            return None
+        LESSON_CACHE_REQUESTS.inc(result="hit")
+        self._lesson_day_cache.move_to_end(key)
+        return [dict(lesson) for lesson in lessons]
+
+    def _cache_day_lessons(self, key: tuple, lessons: list, version: int):
+        """Збереження занять дня, якщо з початку запиту кеш не інвалідувався"""
+        if Config.LESSON_CACHE_SIZE <= 0 or version != self._lesson_day_cache_version:
+            return
+        self._lesson_day_cache[key] = [dict(lesson) for lesson in lessons]
+        self._lesson_day_cache.move_to_end(key)
+        while len(self._lesson_day_cache) > Config.LESSON_CACHE_SIZE:
+            self._lesson_day_cache.popitem(last=False)
+
+    def _invalidate_lesson_days(self, *days):
+        """Видалення з кешу всіх записів за вказані дні (None пропускаються)"""
+        self._lesson_day_cache_version += 1
+        days = {day for day in days if day is not None}
+        for key in [key for key in self._lesson_day_cache if key[0] in days]:
+            del self._lesson_day_cache[key]
+
+    def _clear_lesson_cache(self):
+        """Повне очищення кешу занять (масові зміни занять)"""
+        self._lesson_day_cache_version += 1
+        self._lesson_day_cache.clear()
+
+    def lesson_cache_stats(self) -> dict:
+        """Статистика кешу занять на день: {"hits", "misses", "size", "max_size"}"""
+        return {
+            "hits": int(LESSON_CACHE_REQUESTS.value(result="hit")),
+            "misses": int(LESSON_CACHE_REQUESTS.value(result="miss")),
+            "size": len(self._lesson_day_cache),
+            "max_size": Config.LESSON_CACHE_SIZE
+        }
+
     # === Діти ===
     async def add_child(self, user_id: int, name: str, age: int, base_price: float = 0):
         """Додавання дитини"""
@@ -84,23 +680,88 @@ class Database:
             "updated_at": datetime.utcnow()
         }
         result = await self.db.children.insert_one(child_data)
+        # insert_one додає _id у child_data
+        self._cache_child(dict(child_data))
         return result.inserted_id
 
-    async def get_children(self, user_id: int = None, include_archived: bool = False):
-        """Отримання дітей (для всіх дозволених користувачів)"""
-        from config import Config
+    async def get_children(self, user_id: int = None, include_archived: bool = False, records: bool = False):
+        """Отримання дітей (для всіх дозволених користувачів); records=True - записи Child"""
+        if self._children_cache_complete:
+            children = self._filter_cached_children(archived=None if include_archived else False)
+            return [Child.from_doc(child) for child in children] if records else children
+
+        # За замовчуванням показуємо тільки активних (не архівованих)
+        query = self._children_query(archived=None if include_archived else False)
+        cursor = self.db.children.find(query).sort("created_at", 1)
+        children = await cursor.to_list(length=None)
+        for child in children:
+            self._cache_child(dict(child))
+        return [Child.from_doc(child) for child in children] if records else children
+
+    async def iter_children(self, include_archived: bool = False, batch_size: int = None, records: bool = False):
+        """Потокове читання дітей пачками по batch_size (за замовчуванням CURSOR_BATCH_SIZE)"""
+        async for child in self._iter_children(None if include_archived else False, batch_size):
+            yield Child.from_doc(child) if records else child
+
+    async def iter_archived_children(self, batch_size: int = None, records: bool = False):
+        """Потокове читання архівованих дітей пачками по batch_size"""
+        async for child in self._iter_children(True, batch_size):
+            yield Child.from_doc(child) if records else child
+
+    async def _iter_children(self, archived: bool = None, batch_size: int = None):
+        """Діти з кешу (якщо він повний) або з курсора; у кеш потокове читання не пише"""
+        if self._children_cache_complete:
+            for child in self._filter_cached_children(archived=archived):
+                yield child
+            return
+
+        cursor = self.db.children.find(self._children_query(archived)).sort("created_at", 1)
+        async for child in cursor.batch_size(batch_size or Config.CURSOR_BATCH_SIZE):
+            yield child
+
+    @staticmethod
+    def _children_query(archived: bool = None) -> dict:
+        """Фільтр дітей усіх дозволених користувачів: archived=None - всі, True/False - архівовані/активні"""
         # Фільтр по всіх дозволених користувачах
         query = {"user_id": {"$in": Config.ALLOWED_USER_IDS}}
-        # За замовчуванням показуємо тільки активних (не архівованих)
-        if not include_archived:
+        if archived is True:
+            query["archived"] = True
+        elif archived is False:
             query["archived"] = {"$ne": True}
-        cursor = self.db.children.find(query).sort("created_at", 1)
-        return await cursor.to_list(length=None)
+        return query
 
     async def get_child(self, child_id):
         """Отримання дитини за ID"""
         from bson.objectid import ObjectId
-        return await self.db.children.find_one({"_id": ObjectId(child_id)})
+        child = self._get_cached_child(child_id)
+        if child is not None:
+            return child
+
+        child = await self.db.children.find_one({"_id": ObjectId(child_id)})
+        if child:
+            self._cache_child(dict(child))
+        return child
+
+    async def get_children_by_ids(self, child_ids, records: bool = False):
+        """Отримання дітей за списком ID одним запитом (словник: str(id) -> дитина або запис Child)"""
+        from bson.objectid import ObjectId
+        children = {}
+        missing_ids = set()
+        for child_id in child_ids:
+            child = self._get_cached_child(child_id)
+            if child is not None:
+                children[str(child_id)] = child
+            else:
+                missing_ids.add(ObjectId(child_id))
+
+        if missing_ids:
+            cursor = self.db.children.find({"_id": {"$in": list(missing_ids)}})
+            async for child in cursor:
+                self._cache_child(dict(child))
+                children[str(child['_id'])] = child
+        if records:
+            return {child_id: Child.from_doc(child) for child_id, child in children.items()}
+        return children
 
     async def update_child(self, child_id, name: str = None, age: int = None, base_price: float = None):
         """Оновлення даних дитини"""
@@ -118,141 +779,476 @@ class Database:
             {"_id": ObjectId(child_id)},
             {"$set": update_data}
         )
+        self._update_cached_child(child_id, update_data)
         return result.modified_count > 0
 
     async def delete_child(self, child_id):
         """Видалення дитини"""
         from bson.objectid import ObjectId
         result = await self.db.children.delete_one({"_id": ObjectId(child_id)})
+        self._children_cache.pop(str(child_id), None)
         return result.deleted_count > 0
 
     async def is_child_in_use(self, child_id):
         """
         Перевірка чи дитина використовується в розрахунках
         """
+        usage = await self.get_child_usage(child_id)
+        return usage["in_use"]
+
+    async def get_child_usage(self, child_id, with_counts: bool = False):
+        """
+        Чи є в дитини заняття або оплати.
+        Повертає {"in_use", "has_lessons", "has_payments", "lessons_count", "payments_count"};
+        кількості рахуються лише з with_counts=True (інакше None).
+        """
         from bson.objectid import ObjectId
-        # Перевіряємо чи є заняття для цієї дитини
-        lessons_count = await self.db.lessons.count_documents({"child_id": ObjectId(child_id)})
-        # Перевіряємо чи є оплати для цієї дитини
-        payments_count = await self.db.payments.count_documents({"child_id": ObjectId(child_id)})
+        child_oid = ObjectId(child_id)
 
-        return lessons_count > 0 or payments_count > 0
+        if not with_counts:
+            # Вистачає першого документа; проєкція тільки child_id покривається індексами
+            # child_status_day та child_payment_day, тож документи навіть не читаються
+            projection = {"_id": 0, "child_id": 1}
+            has_lessons = await self.db.lessons.find_one({"child_id": child_oid}, projection) is not None
+            # Якщо заняття є, дитина вже використовується - оплати не перевіряємо (None)
+            has_payments = None
+            if not has_lessons:
+                has_payments = await self.db.payments.find_one({"child_id": child_oid}, projection) is not None
+            return {
+                "in_use": has_lessons or bool(has_payments),
+                "has_lessons": has_lessons,
+                "has_payments": has_payments,
+                "lessons_count": None,
+                "payments_count": None
+            }
+
+        # Обидві кількості одним запитом: заняття + оплати через $unionWith, підрахунок через $facet
+        pipeline = [
+            {"$match": {"child_id": child_oid}},
+            {"$project": {"_id": 0, "source": "lessons"}},
+            {"$unionWith": {
+                "coll": "payments",
+                "pipeline": [
+                    {"$match": {"child_id": child_oid}},
+                    {"$project": {"_id": 0, "source": "payments"}}
+                ]
+            }},
+            {"$facet": {
+                "lessons": [{"$match": {"source": "lessons"}}, {"$count": "count"}],
+                "payments": [{"$match": {"source": "payments"}}, {"$count": "count"}]
+            }}
+        ]
+        rows = await self.db.lessons.aggregate(pipeline).to_list(length=1)
+        facets = rows[0] if rows else {}
+        lessons_count = facets["lessons"][0]["count"] if facets.get("lessons") else 0
+        payments_count = facets["payments"][0]["count"] if facets.get("payments") else 0
+        return {
+            "in_use": lessons_count > 0 or payments_count > 0,
+            "has_lessons": lessons_count > 0,
+            "has_payments": payments_count > 0,
+            "lessons_count": lessons_count,
+            "payments_count": payments_count
+        }
 
     async def archive_child(self, child_id):
         """Архівування дитини"""
         from bson.objectid import ObjectId
+        update_data = {"archived": True, "updated_at": datetime.utcnow()}
         result = await self.db.children.update_one(
             {"_id": ObjectId(child_id)},
-            {"$set": {"archived": True, "updated_at": datetime.utcnow()}}
+            {"$set": update_data}
         )
+        self._update_cached_child(child_id, update_data)
         return result.modified_count > 0
 
     async def unarchive_child(self, child_id):
         """Розархівування дитини"""
         from bson.objectid import ObjectId
+        update_data = {"archived": False, "updated_at": datetime.utcnow()}
         result = await self.db.children.update_one(
             {"_id": ObjectId(child_id)},
-            {"$set": {"archived": False, "updated_at": datetime.utcnow()}}
+            {"$set": update_data}
         )
+        self._update_cached_child(child_id, update_data)
         return result.modified_count > 0
 
     async def get_archived_children(self):
         """Отримання архівованих дітей"""
-        from config import Config
-        query = {
-            "user_id": {"$in": Config.ALLOWED_USER_IDS},
-            "archived": True
-        }
-        cursor = self.db.children.find(query).sort("created_at", 1)
-        return await cursor.to_list(length=None)
+        if self._children_cache_complete:
+            return self._filter_cached_children(archived=True)
+
+        cursor = self.db.children.find(self._children_query(archived=True)).sort("created_at", 1)
+        children = await cursor.to_list(length=None)
+        for child in children:
+            self._cache_child(dict(child))
+        return children
 
     # === Заняття ===
     async def add_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str):
-        """Додавання заняття"""
-        from bson.objectid import ObjectId
-        lesson_data = {
-            "user_id": user_id,
-            "child_id": ObjectId(child_id),
-            "date": date,  # формат: "2024-11-14"
-            "start_time": start_time,  # формат: "10:00"
-            "end_time": end_time,  # формат: "11:00"
-            "completed": False,  # чи проведено заняття
-            "cancelled": False,  # чи скасовано заняття
-            "paid": False,  # чи оплачено заняття
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
-        result = await self.db.lessons.insert_one(lesson_data)
-        return result.inserted_id
+        """Додавання заняття (якщо таке вже є - повертається ID існуючого)"""
+        lesson_id, _ = await self.schedule_lesson(user_id, child_id, date, start_time, end_time)
+        return lesson_id
+
+    async def schedule_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str,
+                              lesson_id=None, session=None):
+        """
+        Додавання заняття через upsert по (дитина, день, час початку).
+        lesson_id - _id нового заняття (за замовчуванням новий ObjectId).
+        Повертає (ID заняття, True якщо створено / False якщо таке заняття вже було).
+        """
+        lesson_data = self._new_lesson_doc(user_id, child_id, date, start_time, end_time)
+        if lesson_id is not None:
+            lesson_data["_id"] = lesson_id
+        lesson = await self.db.lessons.find_one_and_update(
+            self._lesson_slot(lesson_data),
+            {"$setOnInsert": lesson_data},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        created = lesson["_id"] == lesson_data["_id"]
+        if created:
+            self._invalidate_lesson_days(lesson_data["day"])
+        return lesson["_id"], created
+
+    async def add_lessons_bulk(self, lessons: list):
+        """
+        Додавання кількох занять одним запитом (bulk_write з upsert, ordered=False).
+        lessons - список словників з ключами user_id, child_id, date, start_time, end_time.
+        Повертає (ID доданих занять, індекси вже запланованих занять,
+        помилки у вигляді {"index": ..., "error": ...}).
+        """
+        docs = [self._new_lesson_doc(**lesson) for lesson in lessons]
+        if not docs:
+            return [], [], []
+
+        requests = [UpdateOne(self._lesson_slot(doc), {"$setOnInsert": doc}, upsert=True) for doc in docs]
+        errors = []
+        try:
+            result = await self.db.lessons.bulk_write(requests, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            errors = [
+                {"index": error["index"], "error": error.get("errmsg", "")}
+                for error in e.details.get("writeErrors", [])
+            ]
+            upserted = {item["index"] for item in e.details.get("upserted", [])}
+
+        failed = {error["index"] for error in errors}
+        self._invalidate_lesson_days(*(doc["day"] for index, doc in enumerate(docs) if index in upserted))
+        inserted_ids = [doc["_id"] for index, doc in enumerate(docs) if index in upserted]
+        existing = [index for index in range(len(docs)) if index not in upserted and index not in failed]
+        return inserted_ids, existing, errors
+
+    async def remove_duplicate_lessons(self):
+        """
+        Видалення дублікатів запланованих занять (та сама дитина, день і час початку),
+        які заважають створенню індексу child_day_start_unique. Залишається проведене/скасоване
+        заняття або найстаріше з запланованих; проведені та скасовані не видаляються,
+        тож лічильники й зведення не змінюються. Повертає кількість видалених занять.
+        """
+        pipeline = [
+            {"$match": {"day": {"$exists": True}}},
+            {"$sort": {"created_at": 1}},
+            {"$group": {
+                "_id": {"child_id": "$child_id", "day": "$day", "start_min": "$start_min"},
+                "lessons": {"$push": {"_id": "$_id", "completed": "$completed", "cancelled": "$cancelled"}},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        to_delete = []
+        async for group in self.db.lessons.aggregate(pipeline, allowDiskUse=True):
+            lessons = group["lessons"]
+            kept = [lesson for lesson in lessons if lesson.get("completed") or lesson.get("cancelled")]
+            scheduled = [lesson for lesson in lessons if not (lesson.get("completed") or lesson.get("cancelled"))]
+            if not kept:
+                scheduled = scheduled[1:]
+            elif len(kept) > 1:
+                logger.warning(f"⚠️ Кілька проведених/скасованих занять в одному слоті {group['_id']}, потрібна ручна перевірка")
+            to_delete.extend(lesson["_id"] for lesson in scheduled)
+
+        if to_delete:
+            await self.db.lessons.delete_many({"_id": {"$in": to_delete}})
+            self._clear_lesson_cache()
+            logger.info(f"Видалено {len(to_delete)} дублікатів запланованих занять")
+        return len(to_delete)
+
+    async def get_lessons(self, user_id: int = None, child_id: str = None, records: bool = False):
+        """Отримання занять (для всіх дозволених користувачів або конкретної дитини); records=True - записи Lesson"""
+        query = self._lessons_query(child_id=child_id)
+        cursor = self.db.lessons.find(query).sort([("day", -1), ("start_min", -1)])
+        lessons = [self._decode_lesson(lesson) for lesson in await cursor.to_list(length=None)]
+        if Config.DATE_ENCODING_COMPAT:
+            # Документи старого формату не мають day і сервер ставить їх у кінець
+            lessons.sort(key=lambda lesson: (lesson["day"], lesson.get("start_min", 0)), reverse=True)
+        return [Lesson.from_doc(lesson) for lesson in lessons] if records else lessons
+
+    async def get_lessons_in_range(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                                   records: bool = False):
+        """
+        Отримання занять за період [start, end] (формат дат "YYYY-MM-DD").
+        Межі необов'язкові. status: "completed" (проведені), "cancelled" (скасовані)
+        або "scheduled" (заплановані). Результат відсортовано за датою та часом початку.
+        records=True - записи Lesson замість документів.
+        Заняття за один день (start == end) кешуються, див. LESSON_CACHE_SIZE.
+        """
+        query = self._lessons_query(start, end, child_id, status)
+        day_key = None
+        if start and start == end and Config.LESSON_CACHE_SIZE > 0:
+            day_key = (date_to_day(start), str(child_id) if child_id else None, status)
+            lessons = self._get_cached_day_lessons(day_key)
+            if lessons is not None:
+                return [Lesson.from_doc(lesson) for lesson in lessons] if records else lessons
 
-    async def get_lessons(self, user_id: int = None, child_id: str = None):
-        """Отримання занять (для всіх дозволених користувачів або конкретної дитини)"""
+        version = self._lesson_day_cache_version
+        cursor = self.db.lessons.find(query).sort([("day", 1), ("start_min", 1)])
+        lessons = [self._decode_lesson(lesson) for lesson in await cursor.to_list(length=None)]
+        if Config.DATE_ENCODING_COMPAT:
+            lessons.sort(key=lambda lesson: (lesson["day"], lesson.get("start_min", 0)))
+        if day_key is not None:
+            self._cache_day_lessons(day_key, lessons, version)
+        return [Lesson.from_doc(lesson) for lesson in lessons] if records else lessons
+
+    async def iter_lessons(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                           batch_size: int = None, records: bool = False):
+        """
+        Потокове читання занять пачками по batch_size (за замовчуванням CURSOR_BATCH_SIZE)
+        з тими ж фільтрами, що й get_lessons_in_range. Заняття йдуть за датою та часом початку;
+        у режимі сумісності ще не перекодовані документи йдуть першими.
+        """
+        query = self._lessons_query(start, end, child_id, status)
+        cursor = self.db.lessons.find(query).sort([("day", 1), ("start_min", 1)])
+        async for lesson in cursor.batch_size(batch_size or Config.CURSOR_BATCH_SIZE):
+            lesson = self._decode_lesson(lesson)
+            yield Lesson.from_doc(lesson) if records else lesson
+
+    def _lessons_query(self, start: str = None, end: str = None, child_id: str = None, status: str = None) -> dict:
+        """Фільтр занять за періодом, дитиною та статусом (див. get_lessons_in_range)"""
         from bson.objectid import ObjectId
-        from config import Config
 
-        # Фільтруємо по всіх дозволених користувачах
         query = {"user_id": {"$in": Config.ALLOWED_USER_IDS}}
+        query.update(self._day_filter("day", "date", start, end))
         if child_id:
             query["child_id"] = ObjectId(child_id)
 
-        cursor = self.db.lessons.find(query).sort("date", -1)
-        return await cursor.to_list(length=None)
+        if status == "completed":
+            query["completed"] = True
+            query["cancelled"] = {"$ne": True}
+        elif status == "cancelled":
+            query["cancelled"] = True
+        elif status == "scheduled":
+            query["completed"] = {"$ne": True}
+            query["cancelled"] = {"$ne": True}
+        elif status is not None:
+            raise ValueError(f"Невідомий статус заняття: {status}")
+        return query
 
     async def get_lesson(self, lesson_id):
         """Отримання заняття за ID"""
         from bson.objectid import ObjectId
-        return await self.db.lessons.find_one({"_id": ObjectId(lesson_id)})
+        return self._decode_lesson(await self.db.lessons.find_one({"_id": ObjectId(lesson_id)}))
 
     async def update_lesson(self, lesson_id, date: str = None, start_time: str = None, end_time: str = None):
         """Оновлення заняття"""
         from bson.objectid import ObjectId
         update_data = {"updated_at": datetime.utcnow()}
+        # Змінені поля записуються в новому форматі, старі рядкові відповідники видаляються
+        changed = {"date": date, "start_time": start_time, "end_time": end_time}
+        unset = {}
+        for legacy, value in changed.items():
+            if value is not None:
+                field, encode, _ = LEGACY_LESSON_FIELDS[legacy]
+                update_data[field] = encode(value)
+                unset[legacy] = ""
 
-        if date is not None:
-            update_data["date"] = date
-        if start_time is not None:
-            update_data["start_time"] = start_time
-        if end_time is not None:
-            update_data["end_time"] = end_time
-
-        result = await self.db.lessons.update_one(
+        update = {"$set": update_data}
+        if unset:
+            update["$unset"] = unset
+        before = await self.db.lessons.find_one_and_update(
             {"_id": ObjectId(lesson_id)},
-            {"$set": update_data}
+            update,
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
+        if before is None:
+            return False
+        before = self._decode_lesson(before)
+        after = {**before, **update_data}
+        after.update({legacy: value for legacy, value in changed.items() if value is not None})
+        self._invalidate_lesson_days(before["day"], after["day"])
+        # Зміна дати переносить заняття в іншу денну зведену статистику
+        await self._apply_lesson_change(before, after)
+        return True
 
     async def delete_lesson(self, lesson_id):
         """Видалення заняття"""
         from bson.objectid import ObjectId
-        result = await self.db.lessons.delete_one({"_id": ObjectId(lesson_id)})
-        return result.deleted_count > 0
+        lesson = self._decode_lesson(await self.db.lessons.find_one_and_delete({"_id": ObjectId(lesson_id)}))
+        if lesson is None:
+            return False
+        self._invalidate_lesson_days(lesson["day"])
+        await self._apply_lesson_change(lesson, None)
+        return True
 
-    async def mark_lesson_completed(self, lesson_id, completed: bool = True):
-        """Позначення заняття як проведеного або скасування позначки"""
+    @staticmethod
+    def _price_on_completion(price: float) -> dict:
+        """Вираз pipeline-оновлення для price, аналогічний StorageBackend._price_after_completion"""
+        return {"$cond": [{"$eq": ["$completed", True]}, {"$ifNull": ["$price", price]}, price]}
+
+    async def _set_lesson_flag(self, lesson_id, field: str, value: bool):
+        """Зміна прапорця заняття з оновленням лічильників балансу"""
         from bson.objectid import ObjectId
-        result = await self.db.lessons.update_one(
+        changes = {field: value, "updated_at": datetime.utcnow()}
+        update = {"$set": changes}
+        price = None
+        if field == "completed" and value:
+            # Ціна фіксується в занятті при позначенні проведеним, від неї рахується дохід у зведеннях
+            lesson = await self.db.lessons.find_one({"_id": ObjectId(lesson_id)}, {"child_id": 1})
+            if lesson is None:
+                return False
+            price = await self._completion_price(lesson["child_id"])
+            update = [{"$set": {**changes, "price": self._price_on_completion(price)}}]
+        before = await self.db.lessons.find_one_and_update(
             {"_id": ObjectId(lesson_id)},
-            {"$set": {"completed": completed, "updated_at": datetime.utcnow()}}
+            update,
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
+        if before is None:
+            return False
+        before = self._decode_lesson(before)
+        self._invalidate_lesson_days(before["day"])
+        after = {**before, field: value}
+        if price is not None:
+            after["price"] = self._price_after_completion(before, price)
+        await self._apply_lesson_change(before, after)
+        # Як і раніше (modified_count > 0): True лише якщо значення справді змінилось
+        return before.get(field, False) != value
+
+    async def mark_lesson_completed(self, lesson_id, completed: bool = True):
+        """Позначення заняття як проведеного або скасування позначки"""
+        return await self._set_lesson_flag(lesson_id, "completed", completed)
 
     async def mark_lesson_cancelled(self, lesson_id, cancelled: bool = True):
         """Позначення заняття як скасованого або скасування позначки"""
+        return await self._set_lesson_flag(lesson_id, "cancelled", cancelled)
+
+    async def complete_and_roll_forward(self, lesson_id, user_id: int = None):
+        """
+        Позначення заняття проведеним і планування наступного на тиждень після
+        останнього запланованого заняття дитини (або після цього, якщо запланованих немає).
+        Кількість запитів не залежить від історії дитини; все виконується в одній сесії,
+        а з MONGODB_USE_TRANSACTIONS - в транзакції.
+        user_id - власник нового заняття (за замовчуванням власник поточного).
+        Повторний виклик для того ж заняття нічого не планує (created=False).
+        Повертає {"lesson", "next_lesson_id", "next_date", "created"} або None, якщо заняття не знайдено.
+        """
+        async with await self.client.start_session() as session:
+            if Config.MONGODB_USE_TRANSACTIONS:
+                # with_transaction повторює виконання при тимчасових помилках
+                result = await session.with_transaction(
+                    lambda s: self._complete_and_roll_forward(s, lesson_id, user_id)
+                )
+            else:
+                result = await self._complete_and_roll_forward(session, lesson_id, user_id)
+        if result is not None:
+            # Зміни транзакції видно лише після коміту, тож кеш за ці дні скидається ще раз
+            next_day = date_to_day(result["next_date"]) if result["next_date"] else None
+            self._invalidate_lesson_days(result["lesson"]["day"], next_day)
+        return result
+
+    async def _complete_and_roll_forward(self, session, lesson_id, user_id: int = None):
+        """Кроки complete_and_roll_forward в межах сесії"""
         from bson.objectid import ObjectId
-        result = await self.db.lessons.update_one(
+        now = datetime.utcnow()
+        claimed_id = ObjectId()
+        current = await self.db.lessons.find_one({"_id": ObjectId(lesson_id)}, {"child_id": 1}, session=session)
+        if current is None:
+            return None
+        price = await self._completion_price(current["child_id"])
+        # next_lesson_id проставляється тільки якщо його ще немає: повторне позначення
+        # (подвійне натискання, unmark/mark) бачить його в BEFORE і нічого не планує
+        before = await self.db.lessons.find_one_and_update(
             {"_id": ObjectId(lesson_id)},
-            {"$set": {"cancelled": cancelled, "updated_at": datetime.utcnow()}}
+            [{"$set": {
+                "completed": True,
+                "updated_at": now,
+                "price": self._price_on_completion(price),
+                "next_lesson_id": {"$ifNull": ["$next_lesson_id", claimed_id]}
+            }}],
+            return_document=ReturnDocument.BEFORE,
+            session=session
         )
-        return result.modified_count > 0
+        if before is None:
+            return None
+        before = self._decode_lesson(before)
+        self._invalidate_lesson_days(before["day"])
+        lesson = {**before, "completed": True, "updated_at": now, "price": self._price_after_completion(before, price)}
+        await self._apply_lesson_change(before, lesson, session=session)
+
+        if before.get("next_lesson_id") is not None:
+            next_lesson = self._decode_lesson(await self.db.lessons.find_one(
+                {"_id": before["next_lesson_id"]}, {"day": 1, "date": 1}, session=session
+            ))
+            return {
+                "lesson": lesson,
+                "next_lesson_id": before["next_lesson_id"],
+                "next_date": next_lesson["date"] if next_lesson else None,
+                "created": False
+            }
+
+        last = await self._find_last_scheduled_lesson(lesson["child_id"], session=session)
+        last_day = last["day"] if last else lesson["day"]
+        next_date = day_to_date(last_day + 7)
+
+        next_lesson_id, created = await self.schedule_lesson(
+            user_id if user_id is not None else lesson["user_id"],
+            str(lesson["child_id"]), next_date, lesson["start_time"], lesson["end_time"],
+            lesson_id=claimed_id, session=session
+        )
+        if not created:
+            # Слот уже зайнятий іншим заняттям - посилаємось на нього
+            await self.db.lessons.update_one(
+                {"_id": before["_id"]}, {"$set": {"next_lesson_id": next_lesson_id}}, session=session
+            )
+        lesson["next_lesson_id"] = next_lesson_id
+        return {"lesson": lesson, "next_lesson_id": next_lesson_id, "next_date": next_date, "created": created}
+
+    async def _find_last_scheduled_lesson(self, child_id, session=None):
+        """
+        Останнє (за датою та часом) заплановане заняття дитини одним sort-limit-1 запитом
+        по індексу child_status_day. Нові заняття завжди мають completed/cancelled,
+        тому фільтр - рівність, а не $ne, і індекс віддає відсортовані документи.
+        """
+        query = {"child_id": child_id, "completed": False, "cancelled": False}
+        projection = {"day": 1, "date": 1, "start_min": 1, "start_time": 1}
+        last = await self.db.lessons.find_one(
+            {**query, "day": {"$exists": True}}, projection,
+            sort=[("day", DESCENDING), ("start_min", DESCENDING)], session=session
+        )
+        if Config.DATE_ENCODING_COMPAT:
+            # Серед ще не перекодованих занять шукаємо окремо за рядковою датою
+            legacy = await self.db.lessons.find_one(
+                {**query, "day": {"$exists": False}}, projection,
+                sort=[("date", DESCENDING), ("start_time", DESCENDING)], session=session
+            )
+            legacy = self._decode_lesson(legacy)
+            if legacy and (last is None or legacy["day"] > last["day"]):
+                last = legacy
+        return last
 
     async def mark_lesson_paid(self, lesson_id, paid: bool = True):
         """Позначення заняття як оплаченого або скасування позначки"""
         from bson.objectid import ObjectId
-        result = await self.db.lessons.update_one(
+        before = self._decode_lesson(await self.db.lessons.find_one_and_update(
             {"_id": ObjectId(lesson_id)},
-            {"$set": {"paid": paid, "updated_at": datetime.utcnow()}}
-        )
-        return result.modified_count > 0
+            {"$set": {"paid": paid, "updated_at": datetime.utcnow()}},
+            projection={"day": 1, "date": 1, "paid": 1}
+        ))
+        if before is None:
+            return False
+        self._invalidate_lesson_days(before["day"])
+        return before.get("paid", False) != paid
 
     # === Оплати ===
     async def add_payment(self, user_id: int, child_id: str, amount: float, lessons_count: int, payment_date: str, note: str = ""):
@@ -263,38 +1259,290 @@ class Database:
             "child_id": ObjectId(child_id),
             "amount": amount,
             "lessons_count": lessons_count,  # за скільки занять
-            "payment_date": payment_date,  # дата оплати
+            "payment_day": date_to_day(payment_date),  # дата оплати, див. utils/dates.py
             "note": note,  # необов'язкова примітка
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
         result = await self.db.payments.insert_one(payment_data)
+        if self._counts_in_reports(payment_data):
+            await self._inc_child_balance(payment_data["child_id"], paid_lessons=lessons_count)
+            await self._inc_rollup(payment_date, payment_data["child_id"], payments_amount=amount, payments_count=1)
         return result.inserted_id
 
-    async def get_payments(self, user_id: int = None, child_id: str = None):
-        """Отримання оплат (для всіх дозволених користувачів або конкретної дитини)"""
+    async def get_payments(self, user_id: int = None, child_id: str = None, records: bool = False):
+        """Отримання оплат (для всіх дозволених користувачів або конкретної дитини); records=True - записи Payment"""
+        cursor = self.db.payments.find(self._payments_query(child_id)).sort("payment_day", -1)
+        payments = [self._decode_payment(payment) for payment in await cursor.to_list(length=None)]
+        if Config.DATE_ENCODING_COMPAT:
+            payments.sort(key=lambda payment: payment["payment_day"], reverse=True)
+        return [Payment.from_doc(payment) for payment in payments] if records else payments
+
+    async def iter_payments(self, child_id: str = None, batch_size: int = None, records: bool = False):
+        """
+        Потокове читання оплат пачками по batch_size (за замовчуванням CURSOR_BATCH_SIZE),
+        від найстаріших до найновіших; у режимі сумісності ще не перекодовані документи йдуть першими.
+        """
+        cursor = self.db.payments.find(self._payments_query(child_id)).sort("payment_day", 1)
+        async for payment in cursor.batch_size(batch_size or Config.CURSOR_BATCH_SIZE):
+            payment = self._decode_payment(payment)
+            yield Payment.from_doc(payment) if records else payment
+
+    @staticmethod
+    def _payments_query(child_id: str = None) -> dict:
+        """Фільтр оплат усіх дозволених користувачів або конкретної дитини"""
         from bson.objectid import ObjectId
-        from config import Config
 
         # Фільтруємо по всіх дозволених користувачах
         query = {"user_id": {"$in": Config.ALLOWED_USER_IDS}}
         if child_id:
             query["child_id"] = ObjectId(child_id)
+        return query
 
-        cursor = self.db.payments.find(query).sort("payment_date", -1)
+    async def _aggregate_balances(self, include_archived: bool = False):
+        """
+        Перерахунок балансу по дітях з сирих занять та оплат одним aggregation-запитом.
+        Повертає список словників: child_id, child_name, base_price,
+        completed_count, paid_lessons, balance (= оплачені - проведені).
+        """
+        from config import Config
+
+        allowed_users = Config.ALLOWED_USER_IDS
+        match = {"user_id": {"$in": allowed_users}}
+        if not include_archived:
+            match["archived"] = {"$ne": True}
+
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"created_at": 1}},
+            # Кількість проведених (і не скасованих) занять
+            {"$lookup": {
+                "from": "lessons",
+                "let": {"child_id": "$_id"},
+                "pipeline": [
+                    {"$match": {
+                        "$expr": {"$eq": ["$child_id", "$$child_id"]},
+                        "user_id": {"$in": allowed_users},
+                        "completed": True,
+                        "cancelled": {"$ne": True}
+                    }},
+                    {"$count": "count"}
+                ],
+                "as": "completed"
+            }},
+            # Кількість оплачених занять
+            {"$lookup": {
+                "from": "payments",
+                "let": {"child_id": "$_id"},
+                "pipeline": [
+                    {"$match": {
+                        "$expr": {"$eq": ["$child_id", "$$child_id"]},
+                        "user_id": {"$in": allowed_users}
+                    }},
+                    {"$group": {"_id": None, "lessons": {"$sum": "$lessons_count"}}}
+                ],
+                "as": "paid"
+            }},
+            {"$project": {
+                "name": 1,
+                "base_price": 1,
+                "completed_count": {"$ifNull": [{"$arrayElemAt": ["$completed.count", 0]}, 0]},
+                "paid_lessons": {"$ifNull": [{"$arrayElemAt": ["$paid.lessons", 0]}, 0]}
+            }},
+        ]
+
+        balances = []
+        async for row in self.db.children.aggregate(pipeline):
+            balances.append({
+                "child_id": str(row["_id"]),
+                "child_name": row.get("name", "Без імені"),
+                "base_price": row.get("base_price", 0),
+                "completed_count": row["completed_count"],
+                "paid_lessons": row["paid_lessons"],
+                "balance": row["paid_lessons"] - row["completed_count"]
+            })
+        return balances
+
+    # === Лічильники балансу ===
+    async def _inc_child_balance(self, child_id, completed_count: int = 0, paid_lessons: int = 0, session=None):
+        """Атомарна зміна лічильників балансу дитини через $inc"""
+        if not completed_count and not paid_lessons:
+            return
+        await self.db.child_balances.update_one(
+            {"child_id": child_id},
+            {
+                "$inc": {"completed_count": completed_count, "paid_lessons": paid_lessons},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            upsert=True,
+            session=session
+        )
+
+    async def get_balances(self):
+        """
+        Баланс оплат по кожній активній дитині з лічильників child_balances.
+        Формат такий самий, як у _aggregate_balances.
+        """
+        children = await self.get_children()
+        if not children:
+            return []
+
+        cursor = self.db.child_balances.find({"child_id": {"$in": [child["_id"] for child in children]}})
+        counters = {str(row["child_id"]): row async for row in cursor}
+
+        balances = []
+        for child in children:
+            child_id = str(child["_id"])
+            row = counters.get(child_id, {})
+            completed_count = row.get("completed_count", 0)
+            paid_lessons = row.get("paid_lessons", 0)
+            balances.append({
+                "child_id": child_id,
+                "child_name": child.get("name", "Без імені"),
+                "base_price": child.get("base_price", 0),
+                "completed_count": completed_count,
+                "paid_lessons": paid_lessons,
+                "balance": paid_lessons - completed_count
+            })
+        return balances
+
+    async def rebuild_child_balances(self):
+        """Повний перерахунок лічильників child_balances з занять та оплат (для відновлення)"""
+        from bson.objectid import ObjectId
+        balances = await self._aggregate_balances(include_archived=True)
+        now = datetime.utcnow()
+
+        requests = [
+            UpdateOne(
+                {"child_id": ObjectId(row["child_id"])},
+                {"$set": {
+                    "completed_count": row["completed_count"],
+                    "paid_lessons": row["paid_lessons"],
+                    "updated_at": now
+                }},
+                upsert=True
+            )
+            for row in balances
+        ]
+        if requests:
+            await self.db.child_balances.bulk_write(requests, ordered=False)
+        # Лічильники видалених дітей більше не потрібні
+        await self.db.child_balances.delete_many(
+            {"child_id": {"$nin": [ObjectId(row["child_id"]) for row in balances]}}
+        )
+
+        logger.info(f"Лічильники балансу перераховано для {len(balances)} дітей")
+        return len(balances)
+
+    async def ensure_child_balances(self):
+        """Початкове заповнення child_balances, якщо колекція ще порожня"""
+        if await self.db.child_balances.estimated_document_count() == 0:
+            await self.rebuild_child_balances()
+
+    # === Місячні зведення (monthly_rollups) ===
+    # Один документ на (місяць, дитина, день): completed_count, cancelled_count,
+    # income (сума price занять - ціни на момент позначення), payments_amount, payments_count.
+    # Враховуються лише заняття та оплати користувачів з ALLOWED_USER_IDS
+
+    async def _inc_rollup(self, date: str, child_id, session=None, **increments):
+        """Атомарна зміна денного зведення дитини через $inc"""
+        increments = {field: value for field, value in increments.items() if value}
+        if not increments:
+            return
+        await self.db.monthly_rollups.update_one(
+            {"month": date[:7], "child_id": child_id, "day": date},
+            {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            session=session
+        )
+
+    async def get_monthly_rollups(self, month: str):
+        """Денні зведення по дітях за місяць (формат "YYYY-MM"), відсортовані по дню"""
+        cursor = self.db.monthly_rollups.find({"month": month}).sort("day", 1)
         return await cursor.to_list(length=None)
 
+    async def rebuild_monthly_rollups(self):
+        """Повне перезаповнення monthly_rollups з існуючих занять та оплат (backfill)"""
+        prices = {}
+        async for child in self.db.children.find({}, {"base_price": 1}):
+            prices[child["_id"]] = child.get("base_price", 0)
+
+        rollups = {}
+
+        def rollup_for(date, child_id):
+            key = (date, child_id)
+            if key not in rollups:
+                rollups[key] = {
+                    "month": date[:7], "child_id": child_id, "day": date,
+                    "completed_count": 0, "cancelled_count": 0, "income": 0,
+                    "payments_amount": 0, "payments_count": 0
+                }
+            return rollups[key]
+
+        allowed_users = {"user_id": {"$in": Config.ALLOWED_USER_IDS}}
+        lessons_query = {**allowed_users, "$or": [{"completed": True}, {"cancelled": True}]}
+        projection = {"day": 1, "date": 1, "child_id": 1, "completed": 1, "cancelled": 1, "price": 1}
+        async for lesson in self.db.lessons.find(lessons_query, projection):
+            lesson = self._decode_lesson(lesson)
+            completed, cancelled = self._lesson_rollup_counts(lesson)
+            rollup = rollup_for(lesson["date"], lesson["child_id"])
+            rollup["completed_count"] += completed
+            rollup["cancelled_count"] += cancelled
+            if completed:
+                # Заняття без price позначені до його появи - за поточною ціною дитини
+                price = lesson.get("price")
+                rollup["income"] += price if price is not None else prices.get(lesson["child_id"], 0)
+
+        projection = {"payment_day": 1, "payment_date": 1, "child_id": 1, "amount": 1}
+        async for payment in self.db.payments.find(allowed_users, projection):
+            payment = self._decode_payment(payment)
+            rollup = rollup_for(payment["payment_date"], payment["child_id"])
+            rollup["payments_amount"] += payment.get("amount", 0)
+            rollup["payments_count"] += 1
+
+        now = datetime.utcnow()
+        docs = [{**rollup, "updated_at": now} for rollup in rollups.values()]
+        await self.db.monthly_rollups.delete_many({})
+        if docs:
+            await self.db.monthly_rollups.insert_many(docs, ordered=False)
+
+        logger.info(f"Місячні зведення перераховано: {len(docs)} записів")
+        return len(docs)
+
+    async def ensure_monthly_rollups(self):
+        """Початкове заповнення monthly_rollups, якщо колекція ще порожня"""
+        if await self.db.monthly_rollups.estimated_document_count() == 0:
+            await self.rebuild_monthly_rollups()
+
     async def get_payment(self, payment_id):
         """Отримання оплати за ID"""
         from bson.objectid import ObjectId
-        return await self.db.payments.find_one({"_id": ObjectId(payment_id)})
+        return self._decode_payment(await self.db.payments.find_one({"_id": ObjectId(payment_id)}))
 
     async def delete_payment(self, payment_id):
         """Видалення оплати"""
         from bson.objectid import ObjectId
-        result = await self.db.payments.delete_one({"_id": ObjectId(payment_id)})
-        return result.deleted_count > 0
+        payment = self._decode_payment(await self.db.payments.find_one_and_delete({"_id": ObjectId(payment_id)}))
+        if payment is None:
+            return False
+        if self._counts_in_reports(payment):
+            await self._inc_child_balance(payment["child_id"], paid_lessons=-payment.get("lessons_count", 0))
+            await self._inc_rollup(
+                payment["payment_date"], payment["child_id"],
+                payments_amount=-payment.get("amount", 0), payments_count=-1
+            )
+        return True
+
+
+def create_database() -> StorageBackend:
+    """Сховище, вибране в Config.DATABASE_BACKEND"""
+    if Config.DATABASE_BACKEND == "memory":
+        from memory_storage import MemoryDatabase
+        return MemoryDatabase()
+    if Config.DATABASE_BACKEND != "mongodb":
+        raise ValueError(f"Невідоме сховище DATABASE_BACKEND={Config.DATABASE_BACKEND}")
+    return Database()
 
 
 # Глобальний екземпляр бази даних
-db = Database()
+db = create_database()
@@ -0,0 +1,270 @@
+import bson
+import functools
+import inspect
+import logging
+import time
+from pymongo import monitoring
+from config import Config
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Метрики викликів методів сховища
+DB_CALL_SECONDS = Histogram(
+    "db_call_duration_seconds",
+    "Тривалість викликів методів сховища (для iter_* - до вичерпання курсора)",
+    ("method",)
+)
+DB_CALL_ERRORS = Counter(
+    "db_call_errors_total",
+    "Виклики методів сховища, що завершились винятком",
+    ("method",)
+)
+DB_DOCUMENTS_RETURNED = Counter(
+    "db_documents_returned_total",
+    "Документи та записи, повернуті методами сховища",
+    ("method",)
+)
+
+# Метрики команд MongoDB (CommandListener)
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds",
+    "Тривалість команд MongoDB",
+    ("command", "collection")
+)
+MONGO_REPLY_DOCUMENTS = Counter(
+    "mongodb_reply_documents_total",
+    "Документи в пачках курсорів (find, aggregate, getMore), що декодуються драйвером",
+    ("command", "collection")
+)
+MONGO_REPLY_BYTES = Counter(
+    "mongodb_reply_bytes_total",
+    "Розмір відповідей MongoDB у BSON (лише з DB_REPLY_BYTES=true)",
+    ("command", "collection")
+)
+
+
+def _is_document(value) -> bool:
+    """Документ MongoDB або запис models.Child/Lesson/Payment"""
+    if isinstance(value, dict):
+        return "_id" in value
+    return hasattr(value, "__slots__") and hasattr(value, "id")
+
+
+def _count_documents(result) -> int:
+    """
+    Кількість документів у результаті методу: список, словник ID -> документ
+    (get_children_by_ids), один документ/запис або нічого
+    """
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if _is_document(result):
+        return 1
+    if isinstance(result, dict):
+        # Словник документів за ID або зведення з документами серед значень (complete_and_roll_forward)
+        return sum(1 for value in result.values() if _is_document(value))
+    return 0
+
+
+def _call_shape(signature, args, kwargs) -> str:
+    """Виклик з іменами переданих (не None) аргументів без значень: get_lessons_in_range(start, end)"""
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        return "(?)"
+    names = [name for name, value in bound.arguments.items() if name != "self" and value is not None]
+    return f"({', '.join(names)})"
+
+
+def _log_slow_call(name: str, signature, args, kwargs, elapsed: float):
+    if elapsed * 1000 >= Config.DB_SLOW_QUERY_MS:
+        logger.warning(f"🐢 Повільний виклик {name}{_call_shape(signature, args, kwargs)}: {elapsed * 1000:.0f} мс")
+
+
+def _instrument_coroutine(name: str, method):
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await method(*args, **kwargs)
+        except Exception:
+            DB_CALL_ERRORS.inc(method=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_CALL_SECONDS.observe(elapsed, method=name)
+            _log_slow_call(name, signature, args, kwargs, elapsed)
+        documents = _count_documents(result)
+        if documents:
+            DB_DOCUMENTS_RETURNED.inc(documents, method=name)
+        return result
+
+    return wrapper
+
+
+def _instrument_async_generator(name: str, method):
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        # Час рахується лише всередині генератора, без обробки документів викликачем
+        elapsed = 0.0
+        documents = 0
+        generator = method(*args, **kwargs)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                documents += 1
+                yield item
+        except Exception:
+            DB_CALL_ERRORS.inc(method=name)
+            raise
+        finally:
+            await generator.aclose()
+            DB_CALL_SECONDS.observe(elapsed, method=name)
+            if documents:
+                DB_DOCUMENTS_RETURNED.inc(documents, method=name)
+            _log_slow_call(name, signature, args, kwargs, elapsed)
+
+    return wrapper
+
+
+def instrument_storage(cls):
+    """
+    Декоратор класу сховища: усі публічні async-методи та async-генератори, визначені в класі,
+    рахують виклики, латентність, помилки та кількість повернутих документів.
+    Вимикається через DB_INSTRUMENTATION=false.
+    """
+    if not Config.DB_INSTRUMENTATION:
+        return cls
+    for attr, method in list(vars(cls).items()):
+        if attr.startswith("_") or not callable(method):
+            continue
+        name = f"{cls.__name__}.{attr}"
+        if inspect.isasyncgenfunction(method):
+            setattr(cls, attr, _instrument_async_generator(name, method))
+        elif inspect.iscoroutinefunction(method):
+            setattr(cls, attr, _instrument_coroutine(name, method))
+    return cls
+
+
+def _filter_shape(value):
+    """Структура фільтра без значень: {"day": {"$gte": "?"}} - для логів без персональних даних"""
+    if isinstance(value, dict):
+        return {key: _filter_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [_filter_shape(item) for item in value]
+    return "?"
+
+
+def _reply_documents(reply) -> int:
+    """Кількість документів у пачці курсора відповіді (без повторної серіалізації)"""
+    cursor = reply.get("cursor")
+    if not isinstance(cursor, dict):
+        return 0
+    batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+    return len(batch) if isinstance(batch, list) else 0
+
+
+def _command_filter(command):
+    """Фільтр (або pipeline) команди MongoDB"""
+    for key in ("filter", "query", "pipeline"):
+        if key in command:
+            return command[key]
+    # update/delete: фільтр першої операції пачки
+    for key in ("updates", "deletes"):
+        operations = command.get(key)
+        if operations:
+            return operations[0].get("q")
+    return None
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Латентність і кількість документів у відповідях команд MongoDB по колекціях та лог
+    повільних запитів зі структурою фільтра. Події started/succeeded приходять з потоків драйвера.
+    Розмір відповідей у байтах рахується лише з DB_REPLY_BYTES: для цього відповідь
+    серіалізується в BSON ще раз, що для великих пачок майже подвоює роботу з BSON.
+    """
+
+    def __init__(self):
+        # request_id -> (команда, колекція, фільтр) для команд, що виконуються
+        self._pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = ""
+        self._pending[event.request_id] = (
+            event.command_name, collection, _command_filter(event.command)
+        )
+
+    def _finish(self, event):
+        command, collection, query = self._pending.pop(event.request_id, (event.command_name, "", None))
+        elapsed = event.duration_micros / 1_000_000
+        MONGO_COMMAND_SECONDS.observe(elapsed, command=command, collection=collection)
+        if elapsed * 1000 >= Config.DB_SLOW_QUERY_MS:
+            logger.warning(
+                f"🐢 Повільний запит MongoDB: {command} {collection} {elapsed * 1000:.0f} мс, "
+                f"фільтр {_filter_shape(query) if query is not None else '-'}"
+            )
+        return command, collection
+
+    def succeeded(self, event):
+        command, collection = self._finish(event)
+        documents = _reply_documents(event.reply)
+        if documents:
+            MONGO_REPLY_DOCUMENTS.inc(documents, command=command, collection=collection)
+        if Config.DB_REPLY_BYTES:
+            MONGO_REPLY_BYTES.inc(len(bson.encode(event.reply)), command=command, collection=collection)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+def db_stats(limit: int = 15):
+    """
+    Зведення по методах сховища, від найбільшого сумарного часу:
+    [{"method", "calls", "errors", "documents", "total", "avg", "p95"}] (час у секундах).
+    """
+    stats = []
+    for labels, state in DB_CALL_SECONDS.snapshot():
+        method = labels["method"]
+        stats.append({
+            "method": method,
+            "calls": state["count"],
+            "errors": int(DB_CALL_ERRORS.value(method=method)),
+            "documents": int(DB_DOCUMENTS_RETURNED.value(method=method)),
+            "total": state["sum"],
+            "avg": state["sum"] / state["count"] if state["count"] else 0.0,
+            "p95": DB_CALL_SECONDS.quantile(0.95, state)
+        })
+    stats.sort(key=lambda row: row["total"], reverse=True)
+    return stats[:limit]
+
+
+def mongo_stats(limit: int = 10):
+    """Зведення по командах MongoDB: [{"command", "collection", "calls", "total", "documents", "bytes"}]"""
+    stats = []
+    for labels, state in MONGO_COMMAND_SECONDS.snapshot():
+        stats.append({
+            **labels,
+            "calls": state["count"],
+            "total": state["sum"],
+            "documents": int(MONGO_REPLY_DOCUMENTS.value(**labels)),
+            "bytes": int(MONGO_REPLY_BYTES.value(**labels))
+        })
+    stats.sort(key=lambda row: row["total"], reverse=True)
+    return stats[:limit]
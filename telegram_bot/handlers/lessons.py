@@ -8,8 +8,10 @@ from telegram.ext import (
     CommandHandler
 )
 from database import db
+from utils.dates import time_to_minutes
 from config import Config
 import logging
+from collections import deque
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -242,34 +244,17 @@ async def get_lesson_start_time(update: Update, context: ContextTypes.DEFAULT_TY
         return LESSON_START_TIME
 
 
-async def handle_end_time_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробка кнопки швидкого вибору часу закінчення"""
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == "cancel_lesson":
-        await query.edit_message_text("❌ Додавання заняття скасовано.")
-        context.user_data.clear()
-        return ConversationHandler.END
-
-    # Витягуємо час з callback_data
-    time_text = query.data.replace("endtime_", "")
-
-    # Перевіряємо що час закінчення пізніше початку
-    start_time = context.user_data.get('lesson_start_time')
-    if time_text <= start_time:
-        await query.edit_message_text(
-            "❌ Час закінчення має бути пізніше часу початку. Спробуйте ще раз:"
-        )
-        return LESSON_END_TIME
-
-    # Зберігаємо заняття в БД
+async def _save_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE, start_time: str, end_time: str):
+    """
+    Збереження заняття з діалогу /addlesson. Якщо в цей день і час у дитини вже є заняття,
+    нове не створюється і користувач бачить, що слот зайнятий.
+    Повертає текст відповіді та клавіатуру з пропозицією запланувати на місяць.
+    """
     user_id = update.effective_user.id
     child_id = context.user_data.get('lesson_child_id')
     date = context.user_data.get('lesson_date')
-    end_time = time_text
 
-    lesson_id = await db.add_lesson(
+    lesson_id, created = await db.schedule_lesson(
         user_id=user_id,
         child_id=child_id,
         date=date,
@@ -280,7 +265,21 @@ async def handle_end_time_button(update: Update, context: ContextTypes.DEFAULT_T
     child_name = context.user_data.get('lesson_child_name')
     date_display = context.user_data.get('lesson_date_display')
 
-    logger.info(f"User {user_id} added lesson for child {child_id} on {date} from {start_time} to {end_time}")
+    if created:
+        logger.info(f"User {user_id} added lesson for child {child_id} on {date} from {start_time} to {end_time}")
+        header = "✅ Заняття успішно додано!"
+    else:
+        logger.info(f"User {user_id} tried to add lesson for child {child_id} on {date} {start_time}: already scheduled")
+        existing = await db.get_lesson(lesson_id)
+        status = ""
+        if existing and existing.get('cancelled'):
+            status = " (скасоване)"
+        elif existing and existing.get('completed'):
+            status = " (проведене)"
+        # Показуємо час існуючого заняття - кінець може відрізнятись від введеного
+        if existing:
+            end_time = existing.get('end_time', end_time)
+        header = f"ℹ️ Заняття на цей час вже заплановано{status}, нове не додано."
 
     # Зберігаємо дані для можливого повторення
     context.user_data['lesson_added'] = True
@@ -292,17 +291,40 @@ async def handle_end_time_button(update: Update, context: ContextTypes.DEFAULT_T
         [InlineKeyboardButton("✅ Так, запланувати", callback_data="repeat_monthly_yes")],
         [InlineKeyboardButton("❌ Ні, не треба", callback_data="repeat_monthly_no")]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        f"✅ Заняття успішно додано!\n\n"
+    message = (
+        f"{header}\n\n"
         f"Дитина: {child_name}\n"
         f"Дата: {date_display}\n"
         f"Час: {start_time} - {end_time}\n\n"
-        f"💡 Запланувати цей урок на наступний місяць?\n"
-        f"(Заплануються 4 заняття на той самий день тижня і час)",
-        reply_markup=reply_markup
+        "💡 Запланувати цей урок на наступний місяць?\n"
+        "(Заплануються 4 заняття на той самий день тижня і час)"
     )
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+async def handle_end_time_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка кнопки швидкого вибору часу закінчення"""
+    query = update.callback_query
+    await query.answer()
+
+    if query.data == "cancel_lesson":
+        await query.edit_message_text("❌ Додавання заняття скасовано.")
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    # Витягуємо час з callback_data
+    time_text = query.data.replace("endtime_", "")
+
+    # Перевіряємо що час закінчення пізніше початку
+    start_time = context.user_data.get('lesson_start_time')
+    if time_to_minutes(time_text) <= time_to_minutes(start_time):
+        await query.edit_message_text(
+            "❌ Час закінчення має бути пізніше часу початку. Спробуйте ще раз:"
+        )
+        return LESSON_END_TIME
+
+    message, reply_markup = await _save_lesson(update, context, start_time, time_text)
+    await query.edit_message_text(message, reply_markup=reply_markup)
 
     return ASK_REPEAT_MONTHLY
 
@@ -328,52 +350,14 @@ async def get_lesson_end_time(update: Update, context: ContextTypes.DEFAULT_TYPE
 
         # Перевіряємо що час закінчення пізніше початку
         start_time = context.user_data.get('lesson_start_time')
-        if time_formatted <= start_time:
+        if time_to_minutes(time_formatted) <= time_to_minutes(start_time):
             await update.message.reply_text(
                 "❌ Час закінчення має бути пізніше часу початку. Спробуйте ще раз:"
             )
             return LESSON_END_TIME
 
-        # Зберігаємо заняття в БД
-        user_id = update.effective_user.id
-        child_id = context.user_data.get('lesson_child_id')
-        date = context.user_data.get('lesson_date')
-        end_time = time_formatted
-
-        lesson_id = await db.add_lesson(
-            user_id=user_id,
-            child_id=child_id,
-            date=date,
-            start_time=start_time,
-            end_time=end_time
-        )
-
-        child_name = context.user_data.get('lesson_child_name')
-        date_display = context.user_data.get('lesson_date_display')
-
-        logger.info(f"User {user_id} added lesson for child {child_id} on {date} from {start_time} to {end_time}")
-
-        # Зберігаємо дані для можливого повторення
-        context.user_data['lesson_added'] = True
-        context.user_data['last_lesson_id'] = str(lesson_id)
-        context.user_data['lesson_end_time'] = end_time
-
-        # Запитуємо про автоматичне планування
-        keyboard = [
-            [InlineKeyboardButton("✅ Так, запланувати", callback_data="repeat_monthly_yes")],
-            [InlineKeyboardButton("❌ Ні, не треба", callback_data="repeat_monthly_no")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await update.message.reply_text(
-            f"✅ Заняття успішно додано!\n\n"
-            f"Дитина: {child_name}\n"
-            f"Дата: {date_display}\n"
-            f"Час: {start_time} - {end_time}\n\n"
-            f"💡 Запланувати цей урок на наступний місяць?\n"
-            f"(Заплануються 4 заняття на той самий день тижня і час)",
-            reply_markup=reply_markup
-        )
+        message, reply_markup = await _save_lesson(update, context, start_time, time_formatted)
+        await update.message.reply_text(message, reply_markup=reply_markup)
 
         return ASK_REPEAT_MONTHLY
 
@@ -479,27 +463,29 @@ async def confirm_monthly_lessons(update: Update, context: ContextTypes.DEFAULT_
         end_time = context.user_data.get('lesson_end_time')
         future_lessons = context.user_data.get('future_lessons', [])
 
-        # Додаємо всі заняття в БД
-        added_count = 0
-        for lesson in future_lessons:
-            try:
-                await db.add_lesson(
-                    user_id=user_id,
-                    child_id=child_id,
-                    date=lesson['date'],
-                    start_time=start_time,
-                    end_time=end_time
-                )
-                added_count += 1
-            except Exception as e:
-                logger.error(f"Error adding lesson: {e}")
+        # Додаємо всі заняття в БД одним запитом
+        lessons = [
+            {
+                'user_id': user_id,
+                'child_id': child_id,
+                'date': lesson['date'],
+                'start_time': start_time,
+                'end_time': end_time
+            }
+            for lesson in future_lessons
+        ]
+        inserted_ids, existing, errors = await db.add_lessons_bulk(lessons)
+        for error in errors:
+            logger.error(f"Error adding lesson on {lessons[error['index']]['date']}: {error['error']}")
+        added_count = len(inserted_ids)
 
-        logger.info(f"User {user_id} auto-scheduled {added_count} lessons")
+        logger.info(f"User {user_id} auto-scheduled {added_count} lessons, {len(existing)} already scheduled")
 
-        await query.edit_message_text(
-            f"✅ Успішно заплановано {added_count} занять на наступний місяць!\n\n"
-            f"Ви можете переглянути їх у /timetable"
-        )
+        message = f"✅ Успішно заплановано {added_count} занять на наступний місяць!\n\n"
+        if existing:
+            message += f"ℹ️ Вже заплановано раніше: {len(existing)} (не дублюються)\n\n"
+        message += "Ви можете переглянути їх у /timetable"
+        await query.edit_message_text(message)
 
         context.user_data.clear()
         return ConversationHandler.END
@@ -512,15 +498,15 @@ async def timetable_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /timeTable - перегляд розкладу на день"""
     from datetime import timedelta
     today = datetime.now()
-    user_id = update.effective_user.id
 
     # Показуємо розклад на сьогодні
     date_str = today.strftime("%Y-%m-%d")
     date_display = today.strftime("%d.%m.%Y")
 
-    # Отримуємо всі заняття користувача на сьогодні
-    all_lessons = await db.get_lessons(user_id)
-    day_lessons = [lesson for lesson in all_lessons if lesson.get('date') == date_str]
+    # Отримуємо заняття на сьогодні (вже відсортовані по часу початку)
+    day_lessons = await db.get_lessons_in_range(date_str, date_str)
+    # Імена дітей отримуємо одним запитом для всіх занять
+    children = await db.get_children_by_ids([lesson['child_id'] for lesson in day_lessons])
 
     if not day_lessons:
         message = f"📅 Розклад на сьогодні ({date_display})\n\n❌ Занять на сьогодні не знайдено."
@@ -529,13 +515,10 @@ async def timetable_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("📆 На тиждень", callback_data="timetable_week")]
         ]
     else:
-        # Сортуємо заняття по часу початку
-        day_lessons.sort(key=lambda x: x.get('start_time', ''))
         message = f"📅 Розклад на сьогодні ({date_display})\n\n"
 
         for i, lesson in enumerate(day_lessons, 1):
-            # Отримуємо інформацію про дитину
-            child = await db.get_child(str(lesson['child_id']))
+            child = children.get(str(lesson['child_id']))
             child_name = child.get('name', 'Без імені') if child else 'Невідома дитина'
 
             start_time = lesson.get('start_time', 'N/A')
@@ -560,7 +543,7 @@ async def timetable_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for i, lesson in enumerate(day_lessons, 1):
             lesson_id = str(lesson['_id'])
             # Отримуємо ім'я дитини для кнопки
-            child = await db.get_child(str(lesson['child_id']))
+            child = children.get(str(lesson['child_id']))
             child_name = child.get('name', 'Без імені') if child else 'Невідома'
             completed = lesson.get('completed', False)
             cancelled = lesson.get('cancelled', False)
@@ -608,63 +591,39 @@ async def handle_timetable_button(update: Update, context: ContextTypes.DEFAULT_
             lesson_id = query.data.replace("mark_", "")
             is_mark = True
 
-        # Оновлюємо статус заняття
-        await db.mark_lesson_completed(lesson_id, is_mark)
-
-        # Якщо заняття відмічається як проведене, плануємо наступне
+        notice = ""
         if is_mark:
-            # Отримуємо інформацію про поточне заняття
-            current_lesson = await db.get_lesson(lesson_id)
-            if current_lesson:
-                child_id = str(current_lesson['child_id'])
-                start_time = current_lesson['start_time']
-                end_time = current_lesson['end_time']
-
-                # Знаходимо всі майбутні заплановані заняття для цієї дитини
-                all_child_lessons = await db.get_lessons(user_id, child_id)
-                future_lessons = [
-                    lesson for lesson in all_child_lessons
-                    if not lesson.get('completed', False)
-                    and not lesson.get('cancelled', False)
-                ]
-
-                # Знаходимо останнє заплановане заняття
-                if future_lessons:
-                    future_lessons.sort(key=lambda x: (x.get('date', ''), x.get('start_time', '')))
-                    last_lesson = future_lessons[-1]
-                    last_date = datetime.strptime(last_lesson['date'], "%Y-%m-%d")
-                else:
-                    # Якщо немає майбутніх занять, беремо поточне заняття
-                    last_date = datetime.strptime(current_lesson['date'], "%Y-%m-%d")
-
-                # Додаємо 7 днів
-                next_date = last_date + timedelta(days=7)
-                next_date_str = next_date.strftime("%Y-%m-%d")
-
-                # Створюємо нове заняття
-                await db.add_lesson(
-                    user_id=user_id,
-                    child_id=child_id,
-                    date=next_date_str,
-                    start_time=start_time,
-                    end_time=end_time
+            # Позначаємо заняття проведеним і плануємо наступне через тиждень
+            # після останнього запланованого заняття дитини (повторно - не плануємо)
+            result = await db.complete_and_roll_forward(lesson_id, user_id)
+            if result and result['created']:
+                lesson = result['lesson']
+                logger.info(
+                    f"Auto-scheduled next lesson for child {lesson['child_id']} on {result['next_date']} "
+                    f"{lesson['start_time']}-{lesson['end_time']}"
                 )
-
-                logger.info(f"Auto-scheduled next lesson for child {child_id} on {next_date_str} {start_time}-{end_time}")
+            elif result:
+                next_display = (
+                    datetime.strptime(result['next_date'], "%Y-%m-%d").strftime("%d.%m.%Y")
+                    if result['next_date'] else "раніше"
+                )
+                notice = f"ℹ️ Наступне заняття вже заплановано ({next_display})\n\n"
+        else:
+            await db.mark_lesson_completed(lesson_id, False)
 
         # Оновлюємо повідомлення
         date_str = today.strftime("%Y-%m-%d")
         date_display = today.strftime("%d.%m.%Y")
 
-        all_lessons = await db.get_lessons(user_id)
-        day_lessons = [lesson for lesson in all_lessons if lesson.get('date') == date_str]
+        day_lessons = await db.get_lessons_in_range(date_str, date_str)
+        # Імена дітей отримуємо одним запитом для всіх занять
+        children = await db.get_children_by_ids([lesson['child_id'] for lesson in day_lessons])
 
         if day_lessons:
-            day_lessons.sort(key=lambda x: x.get('start_time', ''))
-            message = f"📅 Розклад на сьогодні ({date_display})\n\n"
+            message = f"{notice}📅 Розклад на сьогодні ({date_display})\n\n"
 
             for i, lesson in enumerate(day_lessons, 1):
-                child = await db.get_child(str(lesson['child_id']))
+                child = children.get(str(lesson['child_id']))
                 child_name = child.get('name', 'Без імені') if child else 'Невідома дитина'
                 start_time = lesson.get('start_time', 'N/A')
                 end_time = lesson.get('end_time', 'N/A')
@@ -688,7 +647,7 @@ async def handle_timetable_button(update: Update, context: ContextTypes.DEFAULT_
             for i, lesson in enumerate(day_lessons, 1):
                 lid = str(lesson['_id'])
                 # Отримуємо ім'я дитини для кнопки
-                child = await db.get_child(str(lesson['child_id']))
+                child = children.get(str(lesson['child_id']))
                 child_name = child.get('name', 'Без імені') if child else 'Невідома'
                 completed = lesson.get('completed', False)
                 cancelled = lesson.get('cancelled', False)
@@ -731,15 +690,15 @@ async def handle_timetable_button(update: Update, context: ContextTypes.DEFAULT_
         date_str = today.strftime("%Y-%m-%d")
         date_display = today.strftime("%d.%m.%Y")
 
-        all_lessons = await db.get_lessons(user_id)
-        day_lessons = [lesson for lesson in all_lessons if lesson.get('date') == date_str]
+        day_lessons = await db.get_lessons_in_range(date_str, date_str)
+        # Імена дітей отримуємо одним запитом для всіх занять
+        children = await db.get_children_by_ids([lesson['child_id'] for lesson in day_lessons])
 
         if day_lessons:
-            day_lessons.sort(key=lambda x: x.get('start_time', ''))
             message = f"📅 Розклад на сьогодні ({date_display})\n\n"
 
             for i, lesson in enumerate(day_lessons, 1):
-                child = await db.get_child(str(lesson['child_id']))
+                child = children.get(str(lesson['child_id']))
                 child_name = child.get('name', 'Без імені') if child else 'Невідома дитина'
                 start_time = lesson.get('start_time', 'N/A')
                 end_time = lesson.get('end_time', 'N/A')
@@ -763,7 +722,7 @@ async def handle_timetable_button(update: Update, context: ContextTypes.DEFAULT_
             for i, lesson in enumerate(day_lessons, 1):
                 lid = str(lesson['_id'])
                 # Отримуємо ім'я дитини для кнопки
-                child = await db.get_child(str(lesson['child_id']))
+                child = children.get(str(lesson['child_id']))
                 child_name = child.get('name', 'Без імені') if child else 'Невідома'
                 completed = lesson.get('completed', False)
                 cancelled = lesson.get('cancelled', False)
@@ -796,17 +755,17 @@ async def handle_timetable_button(update: Update, context: ContextTypes.DEFAULT_
         date_str = tomorrow.strftime("%Y-%m-%d")
         date_display = tomorrow.strftime("%d.%m.%Y")
 
-        all_lessons = await db.get_lessons(user_id)
-        day_lessons = [lesson for lesson in all_lessons if lesson.get('date') == date_str]
+        day_lessons = await db.get_lessons_in_range(date_str, date_str)
+        # Імена дітей отримуємо одним запитом для всіх занять
+        children = await db.get_children_by_ids([lesson['child_id'] for lesson in day_lessons])
 
         if not day_lessons:
             message = f"📅 Розклад на завтра ({date_display})\n\n❌ Занять на завтра не знайдено."
         else:
-            day_lessons.sort(key=lambda x: x.get('start_time', ''))
             message = f"📅 Розклад на завтра ({date_display})\n\n"
 
             for i, lesson in enumerate(day_lessons, 1):
-                child = await db.get_child(str(lesson['child_id']))
+                child = children.get(str(lesson['child_id']))
                 child_name = child.get('name', 'Без імені') if child else 'Невідома дитина'
                 start_time = lesson.get('start_time', 'N/A')
                 end_time = lesson.get('end_time', 'N/A')
@@ -828,24 +787,29 @@ async def show_week_timetable(query, user_id: int):
     from datetime import timedelta
     today = datetime.now()
 
-    # Отримуємо всі заняття користувача
-    all_lessons = await db.get_lessons(user_id)
+    # Отримуємо заняття на 7 днів (вже відсортовані по даті та часу)
+    week_end = today + timedelta(days=6)
+    week_lessons = await db.get_lessons_in_range(
+        today.strftime("%Y-%m-%d"), week_end.strftime("%Y-%m-%d"), records=True
+    )
+    # Імена дітей отримуємо одним запитом для всіх занять
+    children = await db.get_children_by_ids([lesson.child_id for lesson in week_lessons], records=True)
+
+    # Групуємо заняття по днях (порядковий номер дня)
+    lessons_by_day = {}
+    for lesson in week_lessons:
+        lessons_by_day.setdefault(lesson.day, []).append(lesson)
 
     message = "📆 Розклад на тиждень\n\n"
 
     # Проходимо по кожному дню тижня
     for day_offset in range(7):
         day = today + timedelta(days=day_offset)
-        date_str = day.strftime("%Y-%m-%d")
         date_display = day.strftime("%d.%m.%Y")
 
-        # Фільтруємо заняття по даті
-        day_lessons = [lesson for lesson in all_lessons if lesson.get('date') == date_str]
+        day_lessons = lessons_by_day.get(day.toordinal(), [])
 
         if day_lessons:
-            # Сортуємо заняття по часу початку
-            day_lessons.sort(key=lambda x: x.get('start_time', ''))
-
             # Визначаємо день тижня
             weekday_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Нд']
             weekday = weekday_names[day.weekday()]
@@ -853,14 +817,11 @@ async def show_week_timetable(query, user_id: int):
             message += f"▪️ {weekday}, {date_display}\n"
 
             for lesson in day_lessons:
-                child = await db.get_child(str(lesson['child_id']))
-                child_name = child.get('name', 'Без імені') if child else 'Невідома дитина'
-                start_time = lesson.get('start_time', 'N/A')
-                end_time = lesson.get('end_time', 'N/A')
-                completed = lesson.get('completed', False)
+                child = children.get(lesson.child_id)
+                child_name = child.name if child else 'Невідома дитина'
 
-                status = "✅ " if completed else ""
-                message += f"  {start_time}-{end_time} | {status}{child_name}\n"
+                status = "✅ " if lesson.completed else ""
+                message += f"  {lesson.start_time}-{lesson.end_time} | {status}{child_name}\n"
 
             message += "\n"
 
@@ -1086,49 +1047,11 @@ def get_payment_entry_conversation_handler():
 @access_control
 async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /balance - перегляд балансу оплат"""
-    user_id = update.effective_user.id
-
-    # Отримуємо всіх дітей
-    all_children = await db.get_children()
-
-    # Отримуємо всі заняття та оплати
-    all_lessons = await db.get_lessons(user_id)
-    all_payments = await db.get_payments(user_id)
-
-    # Рахуємо баланс для кожної дитини
-    children_with_balance = []
-
-    for child in all_children:
-        child_id = str(child['_id'])
-
-        # Рахуємо проведені заняття
-        completed_lessons = [
-            lesson for lesson in all_lessons
-            if str(lesson['child_id']) == child_id
-            and lesson.get('completed', False)
-            and not lesson.get('cancelled', False)
-        ]
-        completed_count = len(completed_lessons)
-
-        # Рахуємо оплачені заняття
-        child_payments = [
-            payment for payment in all_payments
-            if str(payment['child_id']) == child_id
-        ]
-        paid_lessons = sum(p.get('lessons_count', 0) for p in child_payments)
-
-        # Баланс = оплачені - проведені
-        balance = paid_lessons - completed_count
+    # Баланс по кожній дитині рахується одним запитом до БД
+    balances = await db.get_balances()
 
-        # Додаємо тільки якщо є дисбаланс
-        if balance != 0:
-            children_with_balance.append({
-                'child_id': child_id,
-                'child_name': child.get('name', 'Без імені'),
-                'balance': balance,
-                'completed_count': completed_count,
-                'paid_lessons': paid_lessons
-            })
+    # Залишаємо тільки дітей з дисбалансом
+    children_with_balance = [item for item in balances if item['balance'] != 0]
 
     if not children_with_balance:
         await update.message.reply_text(
@@ -1169,35 +1092,30 @@ async def handle_balance_button(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
 
-    user_id = query.from_user.id
-
     if query.data.startswith("balance_child_"):
         child_id = query.data.replace("balance_child_", "")
 
         child = await db.get_child(child_id)
         child_name = child.get('name', 'Без імені') if child else 'Невідома'
 
-        # Отримуємо заняття
-        all_lessons = await db.get_lessons(user_id)
-        child_lessons = [
-            lesson for lesson in all_lessons
-            if str(lesson['child_id']) == child_id
-            and lesson.get('completed', False)
-            and not lesson.get('cancelled', False)
-        ]
-        child_lessons.sort(key=lambda x: (x.get('date', ''), x.get('start_time', '')))
-
-        # Отримуємо оплати
-        all_payments = await db.get_payments(user_id)
-        child_payments = [
-            payment for payment in all_payments
-            if str(payment['child_id']) == child_id
-        ]
-        child_payments.sort(key=lambda x: x.get('payment_date', ''))
+        # Проведені заняття та оплати читаємо потоком: у пам'яті лише останні 5 і підсумки
+        completed_count = 0
+        recent_lessons = deque(maxlen=5)
+        async for lesson in db.iter_lessons(child_id=child_id, status="completed", records=True):
+            completed_count += 1
+            recent_lessons.append(lesson)
+
+        payments_count = 0
+        paid_lessons = 0
+        total_all_amount = 0
+        recent_payments = deque(maxlen=5)
+        async for payment in db.iter_payments(child_id=child_id, records=True):
+            payments_count += 1
+            paid_lessons += payment.lessons_count
+            total_all_amount += payment.amount
+            recent_payments.append(payment)
 
         # Рахуємо баланс
-        completed_count = len(child_lessons)
-        paid_lessons = sum(p.get('lessons_count', 0) for p in child_payments)
         balance = paid_lessons - completed_count
 
         # Формуємо повідомлення
@@ -1213,51 +1131,28 @@ async def handle_balance_button(update: Update, context: ContextTypes.DEFAULT_TY
 
         # Список оплат
         message += "📝 Оплати:\n"
-        if child_payments:
+        if payments_count:
             # Показуємо тільки останні 5
-            recent_payments = child_payments[-5:]
-            if len(child_payments) > 5:
-                message += f"(показано останні 5 з {len(child_payments)})\n"
+            if payments_count > 5:
+                message += f"(показано останні 5 з {payments_count})\n"
 
-            total_amount = 0
             for payment in recent_payments:
-                date_str = payment.get('payment_date', '')
-                try:
-                    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                    date_display = date_obj.strftime("%d.%m.%Y")
-                except:
-                    date_display = date_str
-
-                amount = payment.get('amount', 0)
-                lessons_count = payment.get('lessons_count', 0)
-                total_amount += amount
-
-                message += f"  • {date_display}: {amount} грн за {lessons_count} занять\n"
+                message += f"  • {payment.date_display}: {payment.amount} грн за {payment.lessons_count} занять\n"
 
-            # Рахуємо загальну суму всіх оплат (не тільки останніх 5)
-            total_all_amount = sum(p.get('amount', 0) for p in child_payments)
+            # Загальна сума всіх оплат (не тільки останніх 5)
             message += f"  Всього: {total_all_amount} грн\n\n"
         else:
             message += "  Немає оплат\n\n"
 
         # Список проведених занять
         message += f"📚 Проведено занять: {completed_count}\n"
-        if child_lessons:
+        if completed_count:
             # Показуємо тільки останні 5
-            recent_lessons = child_lessons[-5:]
-            if len(child_lessons) > 5:
-                message += f"(показано останні 5 з {len(child_lessons)})\n"
+            if completed_count > 5:
+                message += f"(показано останні 5 з {completed_count})\n"
 
             for lesson in recent_lessons:
-                date_str = lesson.get('date', '')
-                try:
-                    date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                    date_display = date_obj.strftime("%d.%m.%Y")
-                except:
-                    date_display = date_str
-
-                start_time = lesson.get('start_time', 'N/A')
-                message += f"  • {date_display} {start_time}\n"
+                message += f"  • {lesson.date_display} {lesson.start_time}\n"
 
         keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="balance_back")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1265,47 +1160,11 @@ async def handle_balance_button(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif query.data == "balance_back":
         # Повертаємось до головного меню оплат
-        # Отримуємо всіх дітей
-        all_children = await db.get_children()
-
-        # Отримуємо всі заняття та оплати
-        all_lessons = await db.get_lessons(user_id)
-        all_payments = await db.get_payments(user_id)
-
-        # Рахуємо баланс для кожної дитини
-        children_with_balance = []
-
-        for child in all_children:
-            child_id = str(child['_id'])
-
-            # Рахуємо проведені заняття
-            completed_lessons = [
-                lesson for lesson in all_lessons
-                if str(lesson['child_id']) == child_id
-                and lesson.get('completed', False)
-                and not lesson.get('cancelled', False)
-            ]
-            completed_count = len(completed_lessons)
-
-            # Рахуємо оплачені заняття
-            child_payments = [
-                payment for payment in all_payments
-                if str(payment['child_id']) == child_id
-            ]
-            paid_lessons = sum(p.get('lessons_count', 0) for p in child_payments)
-
-            # Баланс = оплачені - проведені
-            balance = paid_lessons - completed_count
-
-            # Додаємо тільки якщо є дисбаланс
-            if balance != 0:
-                children_with_balance.append({
-                    'child_id': child_id,
-                    'child_name': child.get('name', 'Без імені'),
-                    'balance': balance,
-                    'completed_count': completed_count,
-                    'paid_lessons': paid_lessons
-                })
+        # Баланс по кожній дитині рахується одним запитом до БД
+        balances = await db.get_balances()
+
+        # Залишаємо тільки дітей з дисбалансом
+        children_with_balance = [item for item in balances if item['balance'] != 0]
 
         if not children_with_balance:
             await query.edit_message_text(
@@ -1346,9 +1205,7 @@ async def handle_balance_button(update: Update, context: ContextTypes.DEFAULT_TY
 @access_control
 async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /dashboard - звіт за місяць"""
-    user_id = update.effective_user.id
-
-    from datetime import datetime, timedelta
+    from datetime import datetime
     today = datetime.now()
 
     # Назва місяця українською
@@ -1360,65 +1217,24 @@ async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     month_name = months_uk[today.month]
     year = today.year
 
-    # Перший та останній день місяця
-    first_day = today.replace(day=1).strftime("%Y-%m-%d")
-    if today.month == 12:
-        last_day = today.replace(year=today.year + 1, month=1, day=1)
-    else:
-        last_day = today.replace(month=today.month + 1, day=1)
-    last_day = (last_day - timedelta(days=1)).strftime("%Y-%m-%d")
-
-    # Отримуємо всі заняття за місяць
-    all_lessons = await db.get_lessons(user_id)
-    month_lessons = [
-        lesson for lesson in all_lessons
-        if first_day <= lesson.get('date', '') <= last_day
-    ]
+    # Підсумки місяця з monthly_rollups (по днях і дітях)
+    month_rollups = await db.get_monthly_rollups(today.strftime("%Y-%m"))
 
     # Рахуємо проведені та скасовані
-    completed_count = sum(1 for l in month_lessons if l.get('completed', False) and not l.get('cancelled', False))
-    cancelled_count = sum(1 for l in month_lessons if l.get('cancelled', False))
-
-    # Отримуємо всі оплати за місяць
-    all_payments = await db.get_payments(user_id)
-    month_payments = [
-        payment for payment in all_payments
-        if first_day <= payment.get('payment_date', '') <= last_day
-    ]
+    completed_count = sum(r.get('completed_count', 0) for r in month_rollups)
+    cancelled_count = sum(r.get('cancelled_count', 0) for r in month_rollups)
 
     # Рахуємо суму оплат
-    total_payments_amount = sum(p.get('amount', 0) for p in month_payments)
+    total_payments_amount = sum(r.get('payments_amount', 0) for r in month_rollups)
 
-    # Рахуємо переплати та недоплати в грн
-    all_children = await db.get_children()
+    # Рахуємо переплати та недоплати в грн (за весь час, не тільки за місяць)
+    balances = await db.get_balances()
     total_overpay = 0  # переплата
     total_underpay = 0  # недоплата
 
-    for child in all_children:
-        child_id = str(child['_id'])
-        base_price = child.get('base_price', 0)
-
-        # Рахуємо проведені заняття (всі, не тільки за місяць)
-        child_completed = [
-            lesson for lesson in all_lessons
-            if str(lesson['child_id']) == child_id
-            and lesson.get('completed', False)
-            and not lesson.get('cancelled', False)
-        ]
-        completed_lessons_count = len(child_completed)
-
-        # Рахуємо оплачені заняття (всі оплати)
-        all_child_payments = [
-            payment for payment in all_payments
-            if str(payment['child_id']) == child_id
-        ]
-        paid_lessons_count = sum(p.get('lessons_count', 0) for p in all_child_payments)
-
-        # Баланс в заняттях
-        balance = paid_lessons_count - completed_lessons_count
-
-        # Переводимо в гривні
-        balance_amount = balance * base_price
+    for item in balances:
+        # Переводимо баланс в заняттях у гривні
+        balance_amount = item['balance'] * item['base_price']
 
         if balance_amount > 0:
             total_overpay += balance_amount
@@ -1448,44 +1264,21 @@ async def handle_dashboard_button(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
 
-    user_id = query.from_user.id
-
-    from datetime import datetime, timedelta
+    from datetime import datetime
     today = datetime.now()
 
-    # Перший та останній день місяця
-    first_day = today.replace(day=1).strftime("%Y-%m-%d")
-    if today.month == 12:
-        last_day = today.replace(year=today.year + 1, month=1, day=1)
-    else:
-        last_day = today.replace(month=today.month + 1, day=1)
-    last_day = (last_day - timedelta(days=1)).strftime("%Y-%m-%d")
+    # Підсумки місяця з monthly_rollups (по днях і дітях)
+    month_rollups = await db.get_monthly_rollups(today.strftime("%Y-%m"))
+    # Доходи рахуються тільки з проведених занять
+    income_rollups = [r for r in month_rollups if r.get('completed_count', 0) > 0]
 
     if query.data == "dashboard_by_days":
-        # Доходи по днях (на основі проведених занять)
-        all_lessons = await db.get_lessons(user_id)
-        month_lessons = [
-            lesson for lesson in all_lessons
-            if first_day <= lesson.get('date', '') <= last_day
-            and lesson.get('completed', False)
-            and not lesson.get('cancelled', False)
-        ]
-
-        # Отримуємо всіх дітей для отримання цін
-        all_children = await db.get_children()
-        children_dict = {str(child['_id']): child for child in all_children}
-
         # Групуємо по днях
         from collections import defaultdict
         income_by_day = defaultdict(float)
 
-        for lesson in month_lessons:
-            date_str = lesson.get('date', '')
-            child_id = str(lesson['child_id'])
-            child = children_dict.get(child_id)
-            if child:
-                base_price = child.get('base_price', 0)
-                income_by_day[date_str] += base_price
+        for rollup in income_rollups:
+            income_by_day[rollup['day']] += rollup.get('income', 0)
 
         # Сортуємо по даті
         sorted_days = sorted(income_by_day.items())
@@ -1521,29 +1314,15 @@ async def handle_dashboard_button(update: Update, context: ContextTypes.DEFAULT_
         await query.edit_message_text(message, reply_markup=reply_markup)
 
     elif query.data == "dashboard_by_children":
-        # Доходи по дітях (на основі проведених занять)
-        all_lessons = await db.get_lessons(user_id)
-        month_lessons = [
-            lesson for lesson in all_lessons
-            if first_day <= lesson.get('date', '') <= last_day
-            and lesson.get('completed', False)
-            and not lesson.get('cancelled', False)
-        ]
-
-        # Отримуємо всіх дітей для отримання цін
-        all_children = await db.get_children()
-        children_dict = {str(child['_id']): child for child in all_children}
-
         # Групуємо по дітях
         from collections import defaultdict
         income_by_child = defaultdict(float)
 
-        for lesson in month_lessons:
-            child_id = str(lesson['child_id'])
-            child = children_dict.get(child_id)
-            if child:
-                base_price = child.get('base_price', 0)
-                income_by_child[child_id] += base_price
+        for rollup in income_rollups:
+            income_by_child[str(rollup['child_id'])] += rollup.get('income', 0)
+
+        # Імена дітей (включно з архівованими) одним запитом
+        children_dict = await db.get_children_by_ids(list(income_by_child))
 
         months_uk = {
             1: 'Січень', 2: 'Лютий', 3: 'Березень', 4: 'Квітень',
@@ -1583,57 +1362,21 @@ async def handle_dashboard_button(update: Update, context: ContextTypes.DEFAULT_
         month_name = months_uk[today.month]
         year = today.year
 
-        # Отримуємо всі заняття за місяць
-        all_lessons = await db.get_lessons(user_id)
-        month_lessons = [
-            lesson for lesson in all_lessons
-            if first_day <= lesson.get('date', '') <= last_day
-        ]
-
         # Рахуємо проведені та скасовані
-        completed_count = sum(1 for l in month_lessons if l.get('completed', False) and not l.get('cancelled', False))
-        cancelled_count = sum(1 for l in month_lessons if l.get('cancelled', False))
-
-        # Отримуємо всі оплати за місяць
-        all_payments = await db.get_payments(user_id)
-        month_payments = [
-            payment for payment in all_payments
-            if first_day <= payment.get('payment_date', '') <= last_day
-        ]
+        completed_count = sum(r.get('completed_count', 0) for r in month_rollups)
+        cancelled_count = sum(r.get('cancelled_count', 0) for r in month_rollups)
 
         # Рахуємо суму оплат
-        total_payments_amount = sum(p.get('amount', 0) for p in month_payments)
+        total_payments_amount = sum(r.get('payments_amount', 0) for r in month_rollups)
 
-        # Рахуємо переплати та недоплати в грн
-        all_children = await db.get_children()
+        # Рахуємо переплати та недоплати в грн (за весь час, не тільки за місяць)
+        balances = await db.get_balances()
         total_overpay = 0
         total_underpay = 0
 
-        for child in all_children:
-            child_id = str(child['_id'])
-            base_price = child.get('base_price', 0)
-
-            # Рахуємо проведені заняття (всі)
-            child_completed = [
-                lesson for lesson in all_lessons
-                if str(lesson['child_id']) == child_id
-                and lesson.get('completed', False)
-                and not lesson.get('cancelled', False)
-            ]
-            completed_lessons_count = len(child_completed)
-
-            # Рахуємо оплачені заняття (всі оплати)
-            all_child_payments = [
-                payment for payment in all_payments
-                if str(payment['child_id']) == child_id
-            ]
-            paid_lessons_count = sum(p.get('lessons_count', 0) for p in all_child_payments)
-
-            # Баланс в заняттях
-            balance = paid_lessons_count - completed_lessons_count
-
-            # Переводимо в гривні
-            balance_amount = balance * base_price
+        for item in balances:
+            # Переводимо баланс в заняттях у гривні
+            balance_amount = item['balance'] * item['base_price']
 
             if balance_amount > 0:
                 total_overpay += balance_amount
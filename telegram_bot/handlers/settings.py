@@ -595,14 +595,16 @@ async def confirm_delete_archived(update: Update, context: ContextTypes.DEFAULT_
         await view_archive(update, context)
         return
 
-    # Перевіряємо кількість уроків та оплат
-    from bson.objectid import ObjectId
-    lessons_count = await db.db.lessons.count_documents({"child_id": ObjectId(child_id)})
-    payments_count = await db.db.payments.count_documents({"child_id": ObjectId(child_id)})
+    # Перевіряємо чи є уроки або оплати (кількості рахуємо лише для повідомлення про відмову)
+    usage = await db.get_child_usage(child_id)
+    if usage["in_use"]:
+        usage = await db.get_child_usage(child_id, with_counts=True)
+    lessons_count = usage["lessons_count"] or 0
+    payments_count = usage["payments_count"] or 0
 
     logger.info(f"Archived child has {lessons_count} lessons and {payments_count} payments")
 
-    if lessons_count > 0 or payments_count > 0:
+    if usage["in_use"]:
         logger.info("Archived child has lessons/payments, cannot delete")
         await query.answer(
             f"⛔ Неможливо видалити дитину!\n\n"
@@ -654,11 +656,11 @@ async def delete_archived_child(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     # Додаткова перевірка перед видаленням
-    from bson.objectid import ObjectId
-    lessons_count = await db.db.lessons.count_documents({"child_id": ObjectId(child_id)})
-    payments_count = await db.db.payments.count_documents({"child_id": ObjectId(child_id)})
-
-    if lessons_count > 0 or payments_count > 0:
+    usage = await db.get_child_usage(child_id)
+    if usage["in_use"]:
+        usage = await db.get_child_usage(child_id, with_counts=True)
+        lessons_count = usage["lessons_count"]
+        payments_count = usage["payments_count"]
         logger.warning(f"Attempted to delete child with {lessons_count} lessons and {payments_count} payments")
         await query.answer(
             f"⛔ Неможливо видалити!\n\n"
@@ -10,6 +10,10 @@ from telegram.ext import (
 )
 from config import Config
 from database import db
+from bot_metrics import MetricsApplication, MetricsServer, TimedHTTPXRequest
+from db_metrics import db_stats, mongo_stats
+from metrics import REGISTRY
+from update_processor import PerUserUpdateProcessor, UpdateQueue, WebhookUpdateQueue
 from handlers.settings import (
     settings_command,
     settings_callback,
@@ -35,6 +39,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# HTTP-ендпоінт метрик (запускається в post_init, якщо METRICS_PORT не 0)
+metrics_server = MetricsServer(Config.METRICS_HOST, Config.METRICS_PORT)
+
 
 def access_control(func):
     """Декоратор для перевірки доступу користувача"""
@@ -95,7 +102,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message_text = update.message.text
 
-    # Логування повідомлення
+    # Логування повідомлення (буферизоване, без очікування запису в БД)
     await db.log_message(user.id, message_text)
 
     # Відповідь
@@ -103,6 +110,116 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(response)
 
 
+@access_control
+async def rebuild_balances_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка команди /rebuildbalances - перерахунок лічильників балансу (тільки для адмінів)"""
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна тільки адміністраторам.")
+        return
+
+    children_count = await db.rebuild_child_balances()
+    await update.message.reply_text(f"✅ Лічильники балансу перераховано для {children_count} дітей.")
+
+
+@access_control
+async def rebuild_rollups_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка команди /rebuildrollups - перерахунок місячних зведень (тільки для адмінів)"""
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна тільки адміністраторам.")
+        return
+
+    rollups_count = await db.rebuild_monthly_rollups()
+    await update.message.reply_text(f"✅ Місячні зведення перераховано: {rollups_count} записів.")
+
+
+@access_control
+async def migrate_dates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обробка команди /migratedates - перекодування дат і часу в новий формат, очищення дублікатів
+    та заповнення timestamp у старих логах повідомлень (тільки для адмінів)
+    """
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна тільки адміністраторам.")
+        return
+
+    await update.message.reply_text("⏳ Міграцію дат запущено...")
+    migrated = await db.migrate_date_encoding()
+    # Після перекодування дублікати занять стають видимими для унікального індексу
+    duplicates = await db.remove_duplicate_lessons()
+    await db.ensure_indexes()
+    timestamps = await db.backfill_message_timestamps()
+    message = (
+        f"✅ Міграцію дат завершено.\n"
+        f"Заняття: {migrated['lessons']}\n"
+        f"Оплати: {migrated['payments']}\n"
+        f"Видалено дублікатів занять: {migrated['lesson_duplicates'] + duplicates}\n"
+        f"Заповнено timestamp у логах: {timestamps}\n\n"
+    )
+    if migrated["lesson_conflicts"]:
+        message += (
+            f"⚠️ Не перекодовано занять через зайнятий слот: {migrated['lesson_conflicts']} "
+            f"(кілька проведених/скасованих занять в одному слоті, деталі в логах).\n"
+            f"Виправте їх вручну і запустіть /migratedates ще раз."
+        )
+    else:
+        message += "Після міграції можна вимкнути DATE_ENCODING_COMPAT."
+    await update.message.reply_text(message)
+
+
+@access_control
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка команди /metrics - поточні метрики бота (тільки для адмінів)"""
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна тільки адміністраторам.")
+        return
+
+    # Telegram обмежує довжину повідомлення 4096 символами
+    text = REGISTRY.render()
+    await update.message.reply_text(text[:4000] or "Метрик поки немає.")
+
+
+@access_control
+async def db_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка команди /dbstats - найповільніші методи сховища та команди MongoDB (тільки для адмінів)"""
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна тільки адміністраторам.")
+        return
+
+    methods = db_stats()
+    if not methods:
+        await update.message.reply_text("Статистики викликів поки немає (або DB_INSTRUMENTATION вимкнено).")
+        return
+
+    text = "📊 Методи сховища (сумарний час, виклики, середнє/p95, документи):\n"
+    for row in methods:
+        text += (
+            f"• {row['method']}: {row['total']:.2f} с, {row['calls']} викл., "
+            f"{row['avg'] * 1000:.1f}/{row['p95'] * 1000:.0f} мс, {row['documents']} док."
+        )
+        if row['errors']:
+            text += f", помилок: {row['errors']}"
+        text += "\n"
+
+    commands = mongo_stats()
+    if commands:
+        text += "\n🍃 Команди MongoDB (сумарний час, виклики, відповіді):\n"
+        for row in commands:
+            text += (
+                f"• {row['command']} {row['collection']}: {row['total']:.2f} с, "
+                f"{row['calls']} викл., {row['documents']} док."
+            )
+            if Config.DB_REPLY_BYTES:
+                text += f", {row['bytes'] / 1024:.0f} КБ"
+            text += "\n"
+
+    if hasattr(db, "lesson_cache_stats"):
+        cache = db.lesson_cache_stats()
+        text += f"\n🗂 Кеш занять: {cache['hits']} влучань, {cache['misses']} промахів, {cache['size']}/{cache['max_size']} записів\n"
+
+    # Telegram обмежує довжину повідомлення 4096 символами
+    await update.message.reply_text(text[:4000])
+
+
 async def callback_logger(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Логування всіх callback запитів"""
     if update.callback_query:
@@ -119,21 +236,40 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def post_init(application: Application):
     """Функція, що виконується після ініціалізації бота"""
     await db.connect()
+    await db.load_children_cache()
+    await db.ensure_child_balances()
+    await db.ensure_monthly_rollups()
+    if Config.METRICS_PORT:
+        await metrics_server.start()
     logger.info("🚀 Бот запущено!")
 
 
 async def post_shutdown(application: Application):
     """Функція, що виконується перед зупинкою бота"""
+    # disconnect() дописує буферизовані логи повідомлень перед закриттям з'єднання
     await db.disconnect()
+    await metrics_server.stop()
     logger.info("🛑 Бот зупинено!")
 
 
-def main():
-    """Головна функція запуску бота"""
-    # Створення application
+def build_application(request=None) -> Application:
+    """
+    Створення application з усіма handlers.
+    request - власний BaseRequest для Bot API (наприклад, заглушка без мережі в benchmarks/load_test.py)
+    """
+    # MetricsApplication рахує латентність обробників, TimedHTTPXRequest - запитів до Bot API
+    # (256 - розмір пулу, який ApplicationBuilder задає за замовчуванням)
+    queue_class = WebhookUpdateQueue if Config.BOT_MODE == "webhook" else UpdateQueue
     application = (
         Application.builder()
+        .application_class(MetricsApplication)
         .token(Config.BOT_TOKEN)
+        .request(request or TimedHTTPXRequest(connection_pool_size=256))
+        # Не більше UPDATE_QUEUE_SIZE прийнятих і ще не оброблених оновлень: при перевантаженні polling чекає,
+        # а не накопичує завдання в пам'яті
+        .update_queue(queue_class(Config.UPDATE_QUEUE_SIZE))
+        # Повільний звіт одного користувача не блокує інших, а оновлення кожного користувача йдуть по черзі
+        .concurrent_updates(PerUserUpdateProcessor(Config.CONCURRENT_UPDATES))
         .post_init(post_init)
         .post_shutdown(post_shutdown)
         .build()
@@ -150,6 +286,11 @@ def main():
     application.add_handler(CommandHandler("timetable", timetable_command), group=-1)
     application.add_handler(CommandHandler("balance", balance_command), group=-1)
     application.add_handler(CommandHandler("dashboard", dashboard_command), group=-1)
+    application.add_handler(CommandHandler("rebuildbalances", rebuild_balances_command), group=-1)
+    application.add_handler(CommandHandler("rebuildrollups", rebuild_rollups_command), group=-1)
+    application.add_handler(CommandHandler("migratedates", migrate_dates_command), group=-1)
+    application.add_handler(CommandHandler("metrics", metrics_command), group=-1)
+    application.add_handler(CommandHandler("dbstats", db_stats_command), group=-1)
 
     # Група 0: ConversationHandlers (за замовчуванням)
     application.add_handler(get_add_child_conversation_handler())
@@ -168,10 +309,31 @@ def main():
 
     # Обробка помилок
     application.add_error_handler(error_handler)
+    return application
 
-    # Запуск бота
-    logger.info("Запуск бота...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+def main():
+    """Головна функція запуску бота"""
+    application = build_application()
+
+    # Запуск бота. В обох режимах при зупинці спочатку припиняється прийом оновлень,
+    # потім обробляються вже отримані, і лише після цього викликається post_shutdown
+    if Config.BOT_MODE == "webhook":
+        # Підтримується лише одна репліка: стан діалогів, кеші дітей і занять та черговість
+        # оновлень користувача живуть у пам'яті процесу (див. README, розділ Webhook)
+        logger.info(f"Запуск бота (webhook на {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}/{Config.WEBHOOK_PATH})...")
+        application.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            url_path=Config.WEBHOOK_PATH,
+            webhook_url=f"{Config.WEBHOOK_URL}/{Config.WEBHOOK_PATH}",
+            secret_token=Config.WEBHOOK_SECRET_TOKEN,
+            max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        logger.info("Запуск бота...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
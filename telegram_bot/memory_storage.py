@@ -0,0 +1,524 @@
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from config import Config
+from db_metrics import instrument_storage
+from models import Child, Lesson, Payment
+from storage import StorageBackend
+from utils.dates import date_to_day, day_to_date, time_to_minutes
+import copy
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _oid(value) -> ObjectId:
+    """ObjectId з рядка або ObjectId (як ObjectId(...) у запитах до MongoDB)"""
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+@instrument_storage
+class MemoryDatabase(StorageBackend):
+    """
+    Сховище в пам'яті процесу з тією ж семантикою, що й Database (MongoDB):
+    для локального запуску, профілювання та бенчмарків без mongod (DATABASE_BACKEND=memory).
+    Дані не зберігаються між запусками. Кожна операція виконується без await посередині,
+    тож в межах event loop вона атомарна.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._messages = []
+        self._children = {}
+        self._lessons = {}
+        self._payments = {}
+        # Вторинні індекси занять, аналогічні індексам MongoDB
+        self._lessons_by_day = {}
+        self._lessons_by_child = {}
+        self._lesson_slots = {}
+        self._payments_by_child = {}
+        # Лічильники балансу (child_id -> [проведені, оплачені]) та денні зведення
+        self._balances = {}
+        self._rollups = {}
+
+    # === Підключення та обслуговування ===
+    async def connect(self):
+        logger.info("✅ Використовується сховище в пам'яті (дані не зберігаються)")
+
+    async def disconnect(self):
+        logger.info("Сховище в пам'яті закрито")
+
+    async def ensure_indexes(self):
+        """Індекси в пам'яті підтримуються при кожному записі"""
+
+    async def migrate_date_encoding(self, batch_size: int = None):
+        """Документи в пам'яті завжди в новому форматі"""
+        return {"lessons": 0, "payments": 0, "lesson_duplicates": 0, "lesson_conflicts": 0}
+
+    async def remove_duplicate_lessons(self):
+        """Дублікати неможливі: унікальність слоту перевіряється при записі"""
+        return 0
+
+    async def backfill_message_timestamps(self):
+        """Логи в пам'яті завжди мають timestamp"""
+        return 0
+
+    # === Користувачі ===
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None):
+        user = self._users.setdefault(user_id, {"_id": ObjectId()})
+        user.update({"user_id": user_id, "username": username, "first_name": first_name})
+
+    async def get_user(self, user_id: int):
+        user = self._users.get(user_id)
+        return copy.deepcopy(user) if user else None
+
+    async def get_all_users(self):
+        return [copy.deepcopy(user) for user in self._users.values()]
+
+    async def iter_users(self, batch_size: int = None):
+        for user in list(self._users.values()):
+            yield copy.deepcopy(user)
+
+    # === Повідомлення/Логи ===
+    async def log_message(self, user_id: int, message_text: str, message_type: str = "text"):
+        self._messages.append({
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "message_text": message_text,
+            "message_type": message_type,
+            "timestamp": datetime.utcnow()
+        })
+
+    async def get_user_messages(self, user_id: int, limit: int = 100, before_id: str = None):
+        before = _oid(before_id) if before_id else None
+        messages = []
+        # Логи додаються в порядку зростання _id, тож йдемо з кінця
+        for message in reversed(self._messages):
+            if message["user_id"] != user_id or (before is not None and message["_id"] >= before):
+                continue
+            messages.append(dict(message))
+            if len(messages) >= limit:
+                break
+        return messages
+
+    # === Діти ===
+    async def load_children_cache(self):
+        """Всі діти і так у пам'яті"""
+
+    def _child_visible(self, child, archived: bool = None) -> bool:
+        """Фільтр як у Database._children_query"""
+        if child.get("user_id") not in Config.ALLOWED_USER_IDS:
+            return False
+        return archived is None or bool(child.get("archived", False)) == archived
+
+    def _list_children(self, archived: bool = None):
+        children = [dict(child) for child in self._children.values() if self._child_visible(child, archived)]
+        children.sort(key=lambda child: child.get("created_at") or datetime.min)
+        return children
+
+    async def add_child(self, user_id: int, name: str, age: int, base_price: float = 0):
+        child_id = ObjectId()
+        self._children[child_id] = {
+            "_id": child_id,
+            "user_id": user_id,
+            "name": name,
+            "age": age,
+            "base_price": base_price,
+            "archived": False,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        return child_id
+
+    async def get_children(self, user_id: int = None, include_archived: bool = False, records: bool = False):
+        children = self._list_children(None if include_archived else False)
+        return [Child.from_doc(child) for child in children] if records else children
+
+    async def iter_children(self, include_archived: bool = False, batch_size: int = None, records: bool = False):
+        for child in self._list_children(None if include_archived else False):
+            yield Child.from_doc(child) if records else child
+
+    async def iter_archived_children(self, batch_size: int = None, records: bool = False):
+        for child in self._list_children(True):
+            yield Child.from_doc(child) if records else child
+
+    async def get_archived_children(self):
+        return self._list_children(True)
+
+    async def get_child(self, child_id):
+        child = self._children.get(_oid(child_id))
+        return dict(child) if child else None
+
+    async def get_children_by_ids(self, child_ids, records: bool = False):
+        children = {}
+        for child_id in child_ids:
+            child = self._children.get(_oid(child_id))
+            if child is not None:
+                children[str(child["_id"])] = Child.from_doc(child) if records else dict(child)
+        return children
+
+    def _update_child(self, child_id, update_data: dict) -> bool:
+        """$set як у Database: True лише якщо якесь поле (разом з updated_at) змінилось, як modified_count"""
+        child = self._children.get(_oid(child_id))
+        if child is None:
+            return False
+        update_data = {**update_data, "updated_at": datetime.utcnow()}
+        modified = any(field not in child or child[field] != value for field, value in update_data.items())
+        child.update(update_data)
+        return modified
+
+    async def update_child(self, child_id, name: str = None, age: int = None, base_price: float = None):
+        fields = {"name": name, "age": age, "base_price": base_price}
+        return self._update_child(child_id, {field: value for field, value in fields.items() if value is not None})
+
+    async def delete_child(self, child_id):
+        return self._children.pop(_oid(child_id), None) is not None
+
+    async def is_child_in_use(self, child_id):
+        usage = await self.get_child_usage(child_id)
+        return usage["in_use"]
+
+    async def get_child_usage(self, child_id, with_counts: bool = False):
+        child_oid = _oid(child_id)
+        lessons_count = len(self._lessons_by_child.get(child_oid, ()))
+        payments_count = len(self._payments_by_child.get(child_oid, ()))
+        has_payments = payments_count > 0
+        if not with_counts and lessons_count:
+            # Як у Database: без підрахунку оплати не перевіряються, якщо є заняття
+            has_payments = None
+        return {
+            "in_use": lessons_count > 0 or payments_count > 0,
+            "has_lessons": lessons_count > 0,
+            "has_payments": has_payments,
+            "lessons_count": lessons_count if with_counts else None,
+            "payments_count": payments_count if with_counts else None
+        }
+
+    async def archive_child(self, child_id):
+        return self._update_child(child_id, {"archived": True})
+
+    async def unarchive_child(self, child_id):
+        return self._update_child(child_id, {"archived": False})
+
+    # === Заняття ===
+    def _slot_key(self, lesson) -> tuple:
+        slot = self._lesson_slot(lesson)
+        return slot["child_id"], slot["day"], slot["start_min"]
+
+    def _index_lesson(self, lesson):
+        self._lessons[lesson["_id"]] = lesson
+        self._lessons_by_day.setdefault(lesson["day"], set()).add(lesson["_id"])
+        self._lessons_by_child.setdefault(lesson["child_id"], set()).add(lesson["_id"])
+        self._lesson_slots[self._slot_key(lesson)] = lesson["_id"]
+
+    def _unindex_lesson(self, lesson):
+        self._lessons.pop(lesson["_id"], None)
+        self._lessons_by_day.get(lesson["day"], set()).discard(lesson["_id"])
+        self._lessons_by_child.get(lesson["child_id"], set()).discard(lesson["_id"])
+        self._lesson_slots.pop(self._slot_key(lesson), None)
+
+    def _read_lesson(self, lesson):
+        """Копія заняття з рядковими полями дат/часу, як після читання з MongoDB"""
+        return self._decode_lesson(dict(lesson)) if lesson is not None else None
+
+    async def add_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str):
+        lesson_id, _ = await self.schedule_lesson(user_id, child_id, date, start_time, end_time)
+        return lesson_id
+
+    async def schedule_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str,
+                              lesson_id=None, session=None):
+        lesson = self._new_lesson_doc(user_id, child_id, date, start_time, end_time)
+        if lesson_id is not None:
+            lesson["_id"] = lesson_id
+        existing_id = self._lesson_slots.get(self._slot_key(lesson))
+        if existing_id is not None:
+            return existing_id, False
+        self._index_lesson(lesson)
+        return lesson["_id"], True
+
+    async def add_lessons_bulk(self, lessons: list):
+        # Як у Database: некоректне заняття зупиняє весь виклик ще до запису;
+        # errors лишаються для помилок запису, яких у пам'яті не буває
+        docs = [self._new_lesson_doc(**lesson) for lesson in lessons]
+        inserted_ids, existing = [], []
+        for index, doc in enumerate(docs):
+            if self._slot_key(doc) in self._lesson_slots:
+                existing.append(index)
+                continue
+            self._index_lesson(doc)
+            inserted_ids.append(doc["_id"])
+        return inserted_ids, existing, []
+
+    def _select_lessons(self, start: str = None, end: str = None, child_id: str = None, status: str = None):
+        """Заняття дозволених користувачів за фільтрами get_lessons_in_range (через вторинні індекси)"""
+        if status not in (None, "completed", "cancelled", "scheduled"):
+            raise ValueError(f"Невідомий статус заняття: {status}")
+
+        start_day = date_to_day(start) if start else None
+        end_day = date_to_day(end) if end else None
+        if child_id:
+            candidates = self._lessons_by_child.get(_oid(child_id), ())
+        elif start_day is not None and end_day is not None:
+            candidates = [
+                lesson_id
+                for day in range(start_day, end_day + 1)
+                for lesson_id in self._lessons_by_day.get(day, ())
+            ]
+        else:
+            candidates = self._lessons.keys()
+
+        selected = []
+        for lesson_id in candidates:
+            lesson = self._lessons[lesson_id]
+            if lesson["user_id"] not in Config.ALLOWED_USER_IDS:
+                continue
+            if start_day is not None and lesson["day"] < start_day:
+                continue
+            if end_day is not None and lesson["day"] > end_day:
+                continue
+            completed, cancelled = lesson.get("completed", False), lesson.get("cancelled", False)
+            if status == "completed" and not (completed and not cancelled):
+                continue
+            if status == "cancelled" and not cancelled:
+                continue
+            if status == "scheduled" and (completed or cancelled):
+                continue
+            selected.append(lesson)
+        selected.sort(key=lambda lesson: (lesson["day"], lesson["start_min"]))
+        return selected
+
+    async def get_lessons(self, user_id: int = None, child_id: str = None, records: bool = False):
+        lessons = [self._read_lesson(lesson) for lesson in reversed(self._select_lessons(child_id=child_id))]
+        return [Lesson.from_doc(lesson) for lesson in lessons] if records else lessons
+
+    async def get_lessons_in_range(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                                   records: bool = False):
+        lessons = [self._read_lesson(lesson) for lesson in self._select_lessons(start, end, child_id, status)]
+        return [Lesson.from_doc(lesson) for lesson in lessons] if records else lessons
+
+    async def iter_lessons(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                           batch_size: int = None, records: bool = False):
+        for lesson in self._select_lessons(start, end, child_id, status):
+            lesson = self._read_lesson(lesson)
+            yield Lesson.from_doc(lesson) if records else lesson
+
+    async def get_lesson(self, lesson_id):
+        return self._read_lesson(self._lessons.get(_oid(lesson_id)))
+
+    async def _change_lesson(self, lesson_id, changes: dict):
+        """Зміна заняття з оновленням індексів, лічильників і зведень; False якщо не знайдено"""
+        lesson = self._lessons.get(_oid(lesson_id))
+        if lesson is None:
+            return False
+        updated = {**lesson, **changes, "updated_at": datetime.utcnow()}
+        slot_owner = self._lesson_slots.get(self._slot_key(updated))
+        if slot_owner is not None and slot_owner != lesson["_id"]:
+            raise DuplicateKeyError("E11000 duplicate key error: child_day_start_unique")
+
+        before = self._read_lesson(lesson)
+        self._unindex_lesson(lesson)
+        self._index_lesson(updated)
+        await self._apply_lesson_change(before, self._read_lesson(updated))
+        return True
+
+    async def update_lesson(self, lesson_id, date: str = None, start_time: str = None, end_time: str = None):
+        changes = {}
+        if date is not None:
+            changes["day"] = date_to_day(date)
+        for field, value in (("start_min", start_time), ("end_min", end_time)):
+            if value is not None:
+                changes[field] = time_to_minutes(value)
+        return await self._change_lesson(lesson_id, changes)
+
+    async def delete_lesson(self, lesson_id):
+        lesson = self._lessons.get(_oid(lesson_id))
+        if lesson is None:
+            return False
+        self._unindex_lesson(lesson)
+        await self._apply_lesson_change(self._read_lesson(lesson), None)
+        return True
+
+    async def _set_lesson_flag(self, lesson_id, field: str, value: bool):
+        """Зміна прапорця заняття; True лише якщо значення змінилось (як у Database)"""
+        lesson = self._lessons.get(_oid(lesson_id))
+        if lesson is None:
+            return False
+        changed = lesson.get(field, False) != value
+        changes = {field: value}
+        if field == "completed" and value:
+            # Як у Database: ціна фіксується при позначенні проведеним
+            changes["price"] = self._price_after_completion(lesson, await self._completion_price(lesson["child_id"]))
+        await self._change_lesson(lesson_id, changes)
+        return changed
+
+    async def mark_lesson_completed(self, lesson_id, completed: bool = True):
+        return await self._set_lesson_flag(lesson_id, "completed", completed)
+
+    async def mark_lesson_cancelled(self, lesson_id, cancelled: bool = True):
+        return await self._set_lesson_flag(lesson_id, "cancelled", cancelled)
+
+    async def mark_lesson_paid(self, lesson_id, paid: bool = True):
+        return await self._set_lesson_flag(lesson_id, "paid", paid)
+
+    async def complete_and_roll_forward(self, lesson_id, user_id: int = None):
+        lesson = self._lessons.get(_oid(lesson_id))
+        if lesson is None:
+            return None
+        next_lesson_id = lesson.get("next_lesson_id")
+        claimed_id = ObjectId()
+        # Як у Database: next_lesson_id займається разом з позначкою, повторний виклик нічого не планує
+        price = self._price_after_completion(lesson, await self._completion_price(lesson["child_id"]))
+        await self._change_lesson(lesson_id, {
+            "completed": True, "price": price, "next_lesson_id": next_lesson_id or claimed_id
+        })
+        lesson = self._read_lesson(self._lessons[lesson["_id"]])
+
+        if next_lesson_id is not None:
+            next_lesson = self._lessons.get(next_lesson_id)
+            return {
+                "lesson": lesson,
+                "next_lesson_id": next_lesson_id,
+                "next_date": day_to_date(next_lesson["day"]) if next_lesson else None,
+                "created": False
+            }
+
+        scheduled = self._select_lessons(child_id=str(lesson["child_id"]), status="scheduled")
+        last_day = scheduled[-1]["day"] if scheduled else lesson["day"]
+        next_date = day_to_date(last_day + 7)
+        next_lesson_id, created = await self.schedule_lesson(
+            user_id if user_id is not None else lesson["user_id"],
+            str(lesson["child_id"]), next_date, lesson["start_time"], lesson["end_time"],
+            lesson_id=claimed_id
+        )
+        if not created:
+            self._lessons[lesson["_id"]]["next_lesson_id"] = next_lesson_id
+        lesson["next_lesson_id"] = next_lesson_id
+        return {"lesson": lesson, "next_lesson_id": next_lesson_id, "next_date": next_date, "created": created}
+
+    # === Оплати ===
+    def _read_payment(self, payment):
+        return self._decode_payment(dict(payment)) if payment is not None else None
+
+    def _select_payments(self, child_id: str = None):
+        """Оплати дозволених користувачів від старіших до новіших"""
+        if child_id:
+            candidates = (self._payments[payment_id] for payment_id in self._payments_by_child.get(_oid(child_id), ()))
+        else:
+            candidates = self._payments.values()
+        payments = [payment for payment in candidates if payment["user_id"] in Config.ALLOWED_USER_IDS]
+        payments.sort(key=lambda payment: (payment["payment_day"], payment["_id"]))
+        return payments
+
+    async def add_payment(self, user_id: int, child_id: str, amount: float, lessons_count: int, payment_date: str,
+                          note: str = ""):
+        payment = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "child_id": _oid(child_id),
+            "amount": amount,
+            "lessons_count": lessons_count,
+            "payment_day": date_to_day(payment_date),
+            "note": note,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        self._payments[payment["_id"]] = payment
+        self._payments_by_child.setdefault(payment["child_id"], set()).add(payment["_id"])
+        if self._counts_in_reports(payment):
+            await self._inc_child_balance(payment["child_id"], paid_lessons=lessons_count)
+            await self._inc_rollup(payment_date, payment["child_id"], payments_amount=amount, payments_count=1)
+        return payment["_id"]
+
+    async def get_payments(self, user_id: int = None, child_id: str = None, records: bool = False):
+        payments = [self._read_payment(payment) for payment in reversed(self._select_payments(child_id))]
+        return [Payment.from_doc(payment) for payment in payments] if records else payments
+
+    async def iter_payments(self, child_id: str = None, batch_size: int = None, records: bool = False):
+        for payment in self._select_payments(child_id):
+            payment = self._read_payment(payment)
+            yield Payment.from_doc(payment) if records else payment
+
+    async def get_payment(self, payment_id):
+        return self._read_payment(self._payments.get(_oid(payment_id)))
+
+    async def delete_payment(self, payment_id):
+        payment = self._read_payment(self._payments.pop(_oid(payment_id), None))
+        if payment is None:
+            return False
+        self._payments_by_child.get(payment["child_id"], set()).discard(payment["_id"])
+        if self._counts_in_reports(payment):
+            await self._inc_child_balance(payment["child_id"], paid_lessons=-payment.get("lessons_count", 0))
+            await self._inc_rollup(
+                payment["payment_date"], payment["child_id"],
+                payments_amount=-payment.get("amount", 0), payments_count=-1
+            )
+        return True
+
+    # === Баланси та зведення ===
+    async def _inc_child_balance(self, child_id, completed_count: int = 0, paid_lessons: int = 0, session=None):
+        counters = self._balances.setdefault(child_id, [0, 0])
+        counters[0] += completed_count
+        counters[1] += paid_lessons
+
+    async def _inc_rollup(self, date: str, child_id, session=None, **increments):
+        increments = {field: value for field, value in increments.items() if value}
+        if not increments:
+            return
+        rollup = self._rollups.setdefault((date, child_id), {
+            "_id": ObjectId(), "month": date[:7], "child_id": child_id, "day": date
+        })
+        for field, value in increments.items():
+            rollup[field] = rollup.get(field, 0) + value
+        rollup["updated_at"] = datetime.utcnow()
+
+    async def get_balances(self):
+        balances = []
+        for child in self._list_children(archived=False):
+            completed_count, paid_lessons = self._balances.get(child["_id"], (0, 0))
+            balances.append({
+                "child_id": str(child["_id"]),
+                "child_name": child.get("name", "Без імені"),
+                "base_price": child.get("base_price", 0),
+                "completed_count": completed_count,
+                "paid_lessons": paid_lessons,
+                "balance": paid_lessons - completed_count
+            })
+        return balances
+
+    async def rebuild_child_balances(self):
+        """Перерахунок лічильників з занять та оплат (як Database.rebuild_child_balances)"""
+        self._balances = {}
+        for lesson in self._lessons.values():
+            if lesson["user_id"] in Config.ALLOWED_USER_IDS and self._counts_as_completed(lesson):
+                await self._inc_child_balance(lesson["child_id"], completed_count=1)
+        for payment in self._payments.values():
+            if payment["user_id"] in Config.ALLOWED_USER_IDS:
+                await self._inc_child_balance(payment["child_id"], paid_lessons=payment.get("lessons_count", 0))
+        # Лічильники є тільки для існуючих дітей дозволених користувачів
+        children = {child_id for child_id, child in self._children.items() if self._child_visible(child)}
+        self._balances = {child_id: counters for child_id, counters in self._balances.items() if child_id in children}
+        return len(children)
+
+    async def ensure_child_balances(self):
+        """Лічильники підтримуються з першого запису"""
+
+    async def get_monthly_rollups(self, month: str):
+        rollups = [dict(rollup) for rollup in self._rollups.values() if rollup["month"] == month]
+        rollups.sort(key=lambda rollup: rollup["day"])
+        return rollups
+
+    async def rebuild_monthly_rollups(self):
+        """Перерахунок зведень з занять та оплат (як Database.rebuild_monthly_rollups)"""
+        self._rollups = {}
+        for lesson in self._lessons.values():
+            await self._apply_rollup_change(None, self._read_lesson(lesson))
+        for payment in self._payments.values():
+            if self._counts_in_reports(payment):
+                await self._inc_rollup(
+                    day_to_date(payment["payment_day"]), payment["child_id"],
+                    payments_amount=payment.get("amount", 0), payments_count=1
+                )
+        return len(self._rollups)
+
+    async def ensure_monthly_rollups(self):
+        """Зведення підтримуються з першого запису"""
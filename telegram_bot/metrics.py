@@ -0,0 +1,185 @@
+import threading
+
+# Межі кошиків гістограм латентності (в секундах)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Реєстр метрик з рендерингом у текстовий формат Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Реєстрація метрики (ім'я має бути унікальним)"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} вже зареєстрована")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        """Метрика за ім'ям або None"""
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Всі метрики у текстовому форматі Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальний реєстр метрик
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    """Екранування значення мітки"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra: dict = None) -> str:
+    """Форматування міток: {name="value",...}"""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    """Число у форматі Prometheus"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Базовий клас метрики з мітками (потокобезпечний: події пулу MongoDB приходять з інших потоків)"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        """Ключ значень за мітками"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: очікуються мітки {self.labelnames}, отримано {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """Скидання всіх значень"""
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Лічильник, що тільки зростає"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self):
+        """Пари (мітки, значення)"""
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()
+            ]
+
+
+class Gauge(Counter):
+    """Значення, що може як зростати, так і зменшуватись"""
+
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Гістограма з фіксованими кошиками"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self):
+        """Пари (мітки, {"counts", "sum", "count"}) - копія поточного стану"""
+        with self._lock:
+            return [
+                (dict(zip(self.labelnames, key)), {**state, "counts": list(state["counts"])})
+                for key, state in self._values.items()
+            ]
+
+    def quantile(self, q: float, state: dict) -> float:
+        """Оцінка квантиля за кошиками (верхня межа кошика)"""
+        if not state["count"]:
+            return 0.0
+        target = q * state["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+    def render(self):
+        lines = []
+        for labels, state in self.snapshot():
+            values = tuple(labels[name] for name in self.labelnames)
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = {"le": _format_value(bound)}
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {state['count']}")
+        return lines
@@ -0,0 +1,144 @@
+from datetime import date as date_type
+from utils.dates import day_to_date, minutes_to_time
+
+# Компактні записи замість сирих документів MongoDB (Database.get_*(..., records=True)).
+# __slots__ не створює __dict__ на кожен екземпляр, а поля вже перетворені:
+# ID - рядки, дата - порядковий номер дня, час - хвилини від півночі.
+
+
+# Дата документа, рядкове значення якого не вдалося розібрати (StorageBackend._decode_fields пише day=0)
+UNKNOWN_DATE_DISPLAY = "??.??.????"
+
+
+def _display_date(day: int) -> str:
+    """Дата у форматі "ДД.ММ.РРРР" з порядкового номера дня"""
+    if not day or day <= 0:
+        return UNKNOWN_DATE_DISPLAY
+    return date_type.fromordinal(day).strftime("%d.%m.%Y")
+
+
+class Child:
+    """Дитина"""
+
+    __slots__ = ("id", "user_id", "name", "age", "base_price", "archived")
+
+    def __init__(self, id: str, user_id: int, name: str, age: int, base_price: float, archived: bool):
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.age = age
+        self.base_price = base_price
+        self.archived = archived
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        return cls(
+            id=str(doc["_id"]),
+            user_id=doc.get("user_id"),
+            name=doc.get("name", "Без імені"),
+            age=doc.get("age"),
+            base_price=doc.get("base_price", 0),
+            archived=doc.get("archived", False)
+        )
+
+    def __repr__(self):
+        return f"Child(id={self.id!r}, name={self.name!r})"
+
+
+class Lesson:
+    """Заняття"""
+
+    __slots__ = ("id", "user_id", "child_id", "day", "start_min", "end_min", "completed", "cancelled", "paid")
+
+    def __init__(self, id: str, user_id: int, child_id: str, day: int, start_min: int, end_min: int,
+                 completed: bool = False, cancelled: bool = False, paid: bool = False):
+        self.id = id
+        self.user_id = user_id
+        self.child_id = child_id
+        self.day = day
+        self.start_min = start_min
+        self.end_min = end_min
+        self.completed = completed
+        self.cancelled = cancelled
+        self.paid = paid
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        """Запис з документа, вже доповненого Database._decode_lesson"""
+        return cls(
+            id=str(doc["_id"]),
+            user_id=doc.get("user_id"),
+            child_id=str(doc["child_id"]),
+            day=doc["day"],
+            start_min=doc.get("start_min", 0),
+            end_min=doc.get("end_min", 0),
+            completed=doc.get("completed", False),
+            cancelled=doc.get("cancelled", False),
+            paid=doc.get("paid", False)
+        )
+
+    @property
+    def date(self) -> str:
+        """Дата у форматі "YYYY-MM-DD" """
+        return day_to_date(self.day)
+
+    @property
+    def date_display(self) -> str:
+        return _display_date(self.day)
+
+    @property
+    def start_time(self) -> str:
+        return minutes_to_time(self.start_min)
+
+    @property
+    def end_time(self) -> str:
+        return minutes_to_time(self.end_min)
+
+    @property
+    def counts_as_completed(self) -> bool:
+        """Чи враховується заняття як проведене в балансі"""
+        return self.completed and not self.cancelled
+
+    def __repr__(self):
+        return f"Lesson(id={self.id!r}, child_id={self.child_id!r}, date={self.date!r}, start_time={self.start_time!r})"
+
+
+class Payment:
+    """Оплата"""
+
+    __slots__ = ("id", "user_id", "child_id", "amount", "lessons_count", "day", "note")
+
+    def __init__(self, id: str, user_id: int, child_id: str, amount: float, lessons_count: int, day: int,
+                 note: str = ""):
+        self.id = id
+        self.user_id = user_id
+        self.child_id = child_id
+        self.amount = amount
+        self.lessons_count = lessons_count
+        self.day = day
+        self.note = note
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        """Запис з документа, вже доповненого Database._decode_payment"""
+        return cls(
+            id=str(doc["_id"]),
+            user_id=doc.get("user_id"),
+            child_id=str(doc["child_id"]),
+            amount=doc.get("amount", 0),
+            lessons_count=doc.get("lessons_count", 0),
+            day=doc["payment_day"],
+            note=doc.get("note", "")
+        )
+
+    @property
+    def date(self) -> str:
+        """Дата оплати у форматі "YYYY-MM-DD" """
+        return day_to_date(self.day)
+
+    @property
+    def date_display(self) -> str:
+        return _display_date(self.day)
+
+    def __repr__(self):
+        return f"Payment(id={self.id!r}, child_id={self.child_id!r}, date={self.date!r}, amount={self.amount!r})"
@@ -0,0 +1,366 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from config import Config
+from utils.dates import date_to_day, day_to_date, minutes_to_time, time_to_minutes
+
+# Рядкові поля дат/часу старого формату: числове поле, кодування, декодування
+LEGACY_LESSON_FIELDS = {
+    "date": ("day", date_to_day, day_to_date),
+    "start_time": ("start_min", time_to_minutes, minutes_to_time),
+    "end_time": ("end_min", time_to_minutes, minutes_to_time),
+}
+LEGACY_PAYMENT_FIELDS = {
+    "payment_date": ("payment_day", date_to_day, day_to_date),
+}
+
+
+class StorageBackend(ABC):
+    """
+    Інтерфейс сховища, з яким працюють обробники (database.db).
+    Реалізації: Database (MongoDB, database.py) та MemoryDatabase (в пам'яті, memory_storage.py).
+    Документи мають однаковий вигляд в обох реалізаціях: _id - ObjectId, дати - day/payment_day,
+    час - start_min/end_min, а рядкові date/start_time/end_time/payment_date додаються при читанні.
+    """
+
+    # === Підключення та обслуговування ===
+    @abstractmethod
+    async def connect(self):
+        """Підключення до сховища та підготовка індексів"""
+
+    @abstractmethod
+    async def disconnect(self):
+        """Відключення з дописуванням буферизованих даних"""
+
+    @abstractmethod
+    async def ensure_indexes(self):
+        """Створення відсутніх індексів"""
+
+    @abstractmethod
+    async def migrate_date_encoding(self, batch_size: int = None):
+        """
+        Перекодування дат старого формату: {колекція: кількість документів,
+        "lesson_duplicates": видалені дублікати, "lesson_conflicts": нерозв'язані конфлікти слотів}
+        """
+
+    @abstractmethod
+    async def remove_duplicate_lessons(self):
+        """Видалення дублікатів запланованих занять: кількість видалених"""
+
+    @abstractmethod
+    async def backfill_message_timestamps(self):
+        """Заповнення timestamp у старих логах повідомлень: кількість оновлених"""
+
+    # === Користувачі та логи ===
+    @abstractmethod
+    async def add_user(self, user_id: int, username: str = None, first_name: str = None):
+        """Додавання або оновлення користувача"""
+
+    @abstractmethod
+    async def get_user(self, user_id: int):
+        """Користувач або None"""
+
+    @abstractmethod
+    async def get_all_users(self):
+        """Всі користувачі"""
+
+    @abstractmethod
+    def iter_users(self, batch_size: int = None):
+        """Потокове читання користувачів (async-генератор)"""
+
+    @abstractmethod
+    async def log_message(self, user_id: int, message_text: str, message_type: str = "text"):
+        """Логування повідомлення"""
+
+    @abstractmethod
+    async def get_user_messages(self, user_id: int, limit: int = 100, before_id: str = None):
+        """Історія повідомлень користувача від новіших до старіших"""
+
+    # === Діти ===
+    @abstractmethod
+    async def load_children_cache(self):
+        """Прогрів кешу дітей"""
+
+    @abstractmethod
+    async def add_child(self, user_id: int, name: str, age: int, base_price: float = 0):
+        """Додавання дитини: ID"""
+
+    @abstractmethod
+    async def get_children(self, user_id: int = None, include_archived: bool = False, records: bool = False):
+        """Діти дозволених користувачів, за датою створення"""
+
+    @abstractmethod
+    def iter_children(self, include_archived: bool = False, batch_size: int = None, records: bool = False):
+        """Потокове читання дітей (async-генератор)"""
+
+    @abstractmethod
+    def iter_archived_children(self, batch_size: int = None, records: bool = False):
+        """Потокове читання архівованих дітей (async-генератор)"""
+
+    @abstractmethod
+    async def get_archived_children(self):
+        """Архівовані діти"""
+
+    @abstractmethod
+    async def get_child(self, child_id):
+        """Дитина за ID або None"""
+
+    @abstractmethod
+    async def get_children_by_ids(self, child_ids, records: bool = False):
+        """Словник str(id) -> дитина"""
+
+    @abstractmethod
+    async def update_child(self, child_id, name: str = None, age: int = None, base_price: float = None):
+        """Оновлення даних дитини"""
+
+    @abstractmethod
+    async def delete_child(self, child_id):
+        """Видалення дитини"""
+
+    @abstractmethod
+    async def is_child_in_use(self, child_id):
+        """Чи є в дитини заняття або оплати"""
+
+    @abstractmethod
+    async def get_child_usage(self, child_id, with_counts: bool = False):
+        """{"in_use", "has_lessons", "has_payments", "lessons_count", "payments_count"}"""
+
+    @abstractmethod
+    async def archive_child(self, child_id):
+        """Архівування дитини"""
+
+    @abstractmethod
+    async def unarchive_child(self, child_id):
+        """Відновлення дитини з архіву"""
+
+    # === Заняття ===
+    @abstractmethod
+    async def add_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str):
+        """Додавання заняття: ID (існуючого, якщо слот зайнятий)"""
+
+    @abstractmethod
+    async def schedule_lesson(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str,
+                              lesson_id=None, session=None):
+        """Додавання заняття: (ID, чи створено)"""
+
+    @abstractmethod
+    async def add_lessons_bulk(self, lessons: list):
+        """Додавання кількох занять: (ID доданих, індекси вже запланованих, помилки)"""
+
+    @abstractmethod
+    async def get_lessons(self, user_id: int = None, child_id: str = None, records: bool = False):
+        """Заняття від новіших до старіших"""
+
+    @abstractmethod
+    async def get_lessons_in_range(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                                   records: bool = False):
+        """Заняття за період, дитиною та статусом, за датою та часом початку"""
+
+    @abstractmethod
+    def iter_lessons(self, start: str = None, end: str = None, child_id: str = None, status: str = None,
+                     batch_size: int = None, records: bool = False):
+        """Потокове читання занять (async-генератор)"""
+
+    @abstractmethod
+    async def get_lesson(self, lesson_id):
+        """Заняття за ID або None"""
+
+    @abstractmethod
+    async def update_lesson(self, lesson_id, date: str = None, start_time: str = None, end_time: str = None):
+        """Зміна дати/часу заняття"""
+
+    @abstractmethod
+    async def delete_lesson(self, lesson_id):
+        """Видалення заняття"""
+
+    @abstractmethod
+    async def mark_lesson_completed(self, lesson_id, completed: bool = True):
+        """Позначення заняття проведеним"""
+
+    @abstractmethod
+    async def mark_lesson_cancelled(self, lesson_id, cancelled: bool = True):
+        """Позначення заняття скасованим"""
+
+    @abstractmethod
+    async def mark_lesson_paid(self, lesson_id, paid: bool = True):
+        """Позначення заняття оплаченим"""
+
+    @abstractmethod
+    async def complete_and_roll_forward(self, lesson_id, user_id: int = None):
+        """Позначення проведеним і планування наступного: {"lesson", "next_lesson_id", "next_date", "created"}"""
+
+    # === Оплати ===
+    @abstractmethod
+    async def add_payment(self, user_id: int, child_id: str, amount: float, lessons_count: int, payment_date: str,
+                          note: str = ""):
+        """Додавання оплати: ID"""
+
+    @abstractmethod
+    async def get_payments(self, user_id: int = None, child_id: str = None, records: bool = False):
+        """Оплати від новіших до старіших"""
+
+    @abstractmethod
+    def iter_payments(self, child_id: str = None, batch_size: int = None, records: bool = False):
+        """Потокове читання оплат від старіших до новіших (async-генератор)"""
+
+    @abstractmethod
+    async def get_payment(self, payment_id):
+        """Оплата за ID або None"""
+
+    @abstractmethod
+    async def delete_payment(self, payment_id):
+        """Видалення оплати"""
+
+    # === Баланси та зведення ===
+    @abstractmethod
+    async def get_balances(self):
+        """Баланс по активних дітях"""
+
+    @abstractmethod
+    async def rebuild_child_balances(self):
+        """Перерахунок лічильників балансу: кількість дітей"""
+
+    @abstractmethod
+    async def ensure_child_balances(self):
+        """Початкове заповнення лічильників балансу"""
+
+    @abstractmethod
+    async def get_monthly_rollups(self, month: str):
+        """Денні зведення по дітях за місяць "YYYY-MM" """
+
+    @abstractmethod
+    async def rebuild_monthly_rollups(self):
+        """Перерахунок місячних зведень: кількість записів"""
+
+    @abstractmethod
+    async def ensure_monthly_rollups(self):
+        """Початкове заповнення місячних зведень"""
+
+    # Атомарні зміни лічильників, через які працюють спільні _apply_* нижче
+    @abstractmethod
+    async def _inc_child_balance(self, child_id, completed_count: int = 0, paid_lessons: int = 0, session=None):
+        """Зміна лічильників балансу дитини"""
+
+    @abstractmethod
+    async def _inc_rollup(self, date: str, child_id, session=None, **increments):
+        """Зміна денного зведення дитини"""
+
+    # === Спільна логіка реалізацій ===
+    # Кодування дат і часу: заняття - day (порядковий номер дня), start_min/end_min
+    # (хвилини від півночі); оплати - payment_day. Рядкові date/start_time/end_time/payment_date
+    # додаються лише при читанні, тож обробники працюють з документами як і раніше.
+
+    @staticmethod
+    def _decode_fields(doc, fields: dict):
+        """Доповнення документа рядковими та числовими полями дат/часу (для старих і нових документів)"""
+        if doc is None:
+            return None
+        for legacy, (field, encode, decode) in fields.items():
+            if field in doc and legacy not in doc:
+                doc[legacy] = decode(doc[field])
+            elif legacy in doc and field not in doc:
+                try:
+                    doc[field] = encode(doc[legacy])
+                except (TypeError, ValueError):
+                    # Пошкоджене значення не повинно ламати читання решти даних
+                    doc[field] = 0
+        return doc
+
+    @classmethod
+    def _decode_lesson(cls, lesson):
+        """Заняття з полями в обох форматах"""
+        return cls._decode_fields(lesson, LEGACY_LESSON_FIELDS)
+
+    @classmethod
+    def _decode_payment(cls, payment):
+        """Оплата з полями в обох форматах"""
+        return cls._decode_fields(payment, LEGACY_PAYMENT_FIELDS)
+
+    def _new_lesson_doc(self, user_id: int, child_id: str, date: str, start_time: str, end_time: str):
+        """Документ нового заняття (_id генерується одразу, щоб upsert міг повідомити, чи створено документ)"""
+        from bson.objectid import ObjectId
+        return {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "child_id": ObjectId(child_id),
+            "day": date_to_day(date),  # з "2024-11-14", див. utils/dates.py
+            "start_min": time_to_minutes(start_time),  # з "10:00"
+            "end_min": time_to_minutes(end_time),  # з "11:00"
+            "completed": False,  # чи проведено заняття
+            "cancelled": False,  # чи скасовано заняття
+            "paid": False,  # чи оплачено заняття
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+
+    @staticmethod
+    def _lesson_slot(lesson: dict) -> dict:
+        """Ключ унікальності заняття: дитина, день, час початку (індекс child_day_start_unique)"""
+        return {"child_id": lesson["child_id"], "day": lesson["day"], "start_min": lesson["start_min"]}
+
+    @staticmethod
+    def _counts_as_completed(lesson) -> bool:
+        """Чи враховується заняття як проведене в балансі"""
+        return bool(lesson) and lesson.get("completed", False) and not lesson.get("cancelled", False)
+
+    @classmethod
+    def _lesson_rollup_counts(cls, lesson):
+        """Внесок заняття в денне зведення: (проведені, скасовані)"""
+        if not lesson:
+            return 0, 0
+        return int(cls._counts_as_completed(lesson)), int(bool(lesson.get("cancelled", False)))
+
+    async def _apply_lesson_change(self, before, after, session=None):
+        """Оновлення лічильників і зведень після зміни заняття (before/after - None для нового/видаленого)"""
+        delta = int(self._counts_as_completed(after)) - int(self._counts_as_completed(before))
+        # Як і rebuild_child_balances, лічильники враховують лише заняття дозволених користувачів
+        if delta and self._counts_in_reports(after or before):
+            child_id = (after or before)["child_id"]
+            await self._inc_child_balance(child_id, completed_count=delta, session=session)
+
+        await self._apply_rollup_change(before, after, session=session)
+
+    async def _completion_price(self, child_id) -> float:
+        """Ціна, що фіксується в занятті (поле price) при позначенні проведеним: базова ціна дитини"""
+        child = await self.get_child(child_id)
+        return child.get("base_price", 0) if child else 0
+
+    @staticmethod
+    def _price_after_completion(lesson, price: float) -> float:
+        """Ціна заняття після позначення проведеним: вже проведене зберігає зафіксовану раніше ціну"""
+        if lesson.get("completed", False) and lesson.get("price") is not None:
+            return lesson["price"]
+        return price
+
+    async def _lesson_income(self, lesson) -> float:
+        """
+        Дохід від проведеного заняття: ціна на момент позначення (price).
+        Заняття, позначені до появи поля price, рахуються за поточною базовою ціною дитини.
+        """
+        if lesson.get("price") is not None:
+            return lesson["price"]
+        return await self._completion_price(lesson["child_id"])
+
+    @staticmethod
+    def _counts_in_reports(doc) -> bool:
+        """Чи враховується заняття/оплата в лічильниках балансу та зведеннях: лише записи дозволених користувачів"""
+        return doc.get("user_id") in Config.ALLOWED_USER_IDS
+
+    async def _apply_rollup_change(self, before, after, session=None):
+        """Перенесення внеску заняття в зведеннях зі стану before у стан after"""
+        deltas = {}
+        for lesson, sign in ((before, -1), (after, 1)):
+            completed, cancelled = self._lesson_rollup_counts(lesson)
+            if not completed and not cancelled or not self._counts_in_reports(lesson):
+                continue
+            key = (lesson["date"], lesson["child_id"])
+            delta = deltas.setdefault(key, [0, 0, 0])
+            delta[0] += sign * completed
+            delta[1] += sign * cancelled
+            if completed:
+                delta[2] += sign * await self._lesson_income(lesson)
+
+        for (date, child_id), (completed, cancelled, income) in deltas.items():
+            await self._inc_rollup(
+                date, child_id, session=session,
+                completed_count=completed, cancelled_count=cancelled, income=income
+            )
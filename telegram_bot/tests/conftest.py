@@ -0,0 +1,39 @@
+"""
+Спільні фікстури тестів. Модулі бота імпортуються з кореня telegram_bot (як у main.py),
+а Config читає змінні середовища при імпорті, тож вони задаються тут до першого імпорту.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("ALLOWED_USER_IDS", "1")
+
+TEST_USER_ID = 1
+
+
+@pytest.fixture(params=["memory", "mongodb"])
+def storage(request):
+    """
+    Кожен тест сховища виконується на обох реалізаціях StorageBackend.
+    MongoDB - через mongomock-motor; без нього варіант mongodb пропускається.
+    """
+    if request.param == "memory":
+        from memory_storage import MemoryDatabase
+        return MemoryDatabase()
+
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from database import Database
+    database = Database()
+    database.client = mongomock_motor.AsyncMongoMockClient()
+    database.db = database.client["telegram_bot_test"]
+    return database
+
+
+@pytest.fixture
+def run():
+    """Виконання корутини в новому event loop (тести синхронні, без pytest-asyncio)"""
+    return asyncio.run
@@ -0,0 +1,89 @@
+"""
+Контракт StorageBackend: MemoryDatabase має поводитись так само, як Database (MongoDB),
+бо замінює її в бенчмарках і локальному запуску.
+"""
+import pytest
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from conftest import TEST_USER_ID
+
+
+def _lesson(child_id, date="2026-01-05", start_time="10:00", end_time="11:00"):
+    return {
+        "user_id": TEST_USER_ID, "child_id": str(child_id), "date": date,
+        "start_time": start_time, "end_time": end_time
+    }
+
+
+def test_update_child_reports_modification(storage, run):
+    async def scenario():
+        child_id = await storage.add_child(TEST_USER_ID, "Оля", 7, 300)
+        assert await storage.update_child(child_id, name="Олена") is True
+        assert (await storage.get_child(child_id))["name"] == "Олена"
+        # Неіснуюча дитина: нічого не змінено
+        assert await storage.update_child(ObjectId(), name="Хтось") is False
+
+    run(scenario())
+
+
+def test_archive_child_fields(storage, run):
+    async def scenario():
+        child_id = await storage.add_child(TEST_USER_ID, "Оля", 7, 300)
+        assert await storage.archive_child(child_id) is True
+        child = await storage.get_child(child_id)
+        assert child["archived"] is True
+        assert "archived_at" not in child
+
+        assert await storage.unarchive_child(child_id) is True
+        assert (await storage.get_child(child_id))["archived"] is False
+        assert await storage.archive_child(ObjectId()) is False
+        assert await storage.unarchive_child(ObjectId()) is False
+
+    run(scenario())
+
+
+def test_schedule_lesson_keeps_booked_slot(storage, run):
+    async def scenario():
+        child_id = await storage.add_child(TEST_USER_ID, "Оля", 7, 300)
+        lesson_id, created = await storage.schedule_lesson(**_lesson(child_id))
+        assert created is True
+
+        again_id, created = await storage.schedule_lesson(**_lesson(child_id, end_time="11:30"))
+        assert created is False
+        assert again_id == lesson_id
+        lesson = await storage.get_lesson(lesson_id)
+        assert lesson["end_time"] == "11:00"
+
+    run(scenario())
+
+
+def test_add_lessons_bulk_skips_booked_slots(storage, run):
+    async def scenario():
+        child_id = await storage.add_child(TEST_USER_ID, "Оля", 7, 300)
+        await storage.schedule_lesson(**_lesson(child_id))
+
+        # Зайнятий слот останній: mongomock нумерує upserted за порядком вставок, а не операцій
+        inserted_ids, existing, errors = await storage.add_lessons_bulk([
+            _lesson(child_id, date="2026-01-12"),
+            _lesson(child_id, date="2026-01-19"),
+            _lesson(child_id),
+        ])
+        assert len(inserted_ids) == 2
+        assert existing == [2]
+        assert errors == []
+        lessons = await storage.get_lessons_in_range("2026-01-01", "2026-01-31")
+        assert [lesson["date"] for lesson in lessons] == ["2026-01-05", "2026-01-12", "2026-01-19"]
+
+    run(scenario())
+
+
+def test_add_lessons_bulk_rejects_invalid_lesson(storage, run):
+    async def scenario():
+        child_id = await storage.add_child(TEST_USER_ID, "Оля", 7, 300)
+        # Некоректне заняття зупиняє весь виклик: коректні теж не записуються
+        with pytest.raises(InvalidId):
+            await storage.add_lessons_bulk([_lesson(child_id), _lesson("not-an-id")])
+        assert await storage.get_lessons_in_range("2026-01-01", "2026-01-31") == []
+
+    run(scenario())
@@ -0,0 +1,91 @@
+"""
+Webhook при вичерпаному ліміті прийнятих оновлень: справжній сервер PTB (tornado),
+WebhookUpdateQueue та PerUserUpdateProcessor з кількома слотами, Bot API - заглушка з benchmarks.
+"""
+import asyncio
+import json
+import socket
+from http import HTTPStatus
+
+import pytest
+
+pytest.importorskip("tornado")
+httpx = pytest.importorskip("httpx")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, TypeHandler  # noqa: E402
+from telegram.ext._utils.webhookhandler import WebhookAppClass, WebhookServer  # noqa: E402
+
+from benchmarks.load_test import StubBotRequest, UpdateFactory  # noqa: E402
+from update_processor import PerUserUpdateProcessor, WebhookUpdateQueue  # noqa: E402
+
+MAX_PENDING = 3
+CONCURRENT_UPDATES = 2
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_webhook_rejects_updates_over_pending_limit(run):
+    async def scenario():
+        queue = WebhookUpdateQueue(MAX_PENDING)
+        application = (
+            Application.builder()
+            .token("123456:test")
+            .request(StubBotRequest())
+            .update_queue(queue)
+            .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+            .build()
+        )
+        release = asyncio.Event()
+        started = []
+
+        async def slow_handler(update, context):
+            started.append(update.update_id)
+            await release.wait()
+
+        application.add_handler(TypeHandler(Update, slow_handler))
+
+        port = _free_port()
+        server = WebhookServer("127.0.0.1", port, WebhookAppClass("/telegram", application.bot, queue), None)
+        url = f"http://127.0.0.1:{port}/telegram"
+        factory = UpdateFactory(application.bot)
+
+        async def post(client, user_id):
+            update = factory.message(user_id, "/start")
+            response = await client.post(url, content=json.dumps(update.to_dict()),
+                                         headers={"Content-Type": "application/json"})
+            return response.status_code
+
+        async with application:
+            await application.start()
+            await server.serve_forever()
+            try:
+                async with httpx.AsyncClient() as client:
+                    # Два оновлення займають слоти, третє чекає на слот - ліміт вичерпано
+                    statuses = [await post(client, user_id) for user_id in range(1, MAX_PENDING + 1)]
+                    assert statuses == [HTTPStatus.OK] * MAX_PENDING
+                    while len(started) < CONCURRENT_UPDATES:
+                        await asyncio.sleep(0.01)
+                    assert queue.pending == MAX_PENDING
+
+                    assert await post(client, MAX_PENDING + 1) == HTTPStatus.SERVICE_UNAVAILABLE
+                    assert queue.pending == MAX_PENDING
+
+                    # Після обробки місце звільняється і оновлення знову приймаються
+                    release.set()
+                    await asyncio.wait_for(queue.join(), 5)
+                    assert queue.pending == 0
+                    assert await post(client, MAX_PENDING + 1) == HTTPStatus.OK
+                    await asyncio.wait_for(queue.join(), 5)
+            finally:
+                release.set()
+                await server.shutdown()
+                await application.stop()
+
+        assert len(started) == MAX_PENDING + 1
+
+    run(scenario())
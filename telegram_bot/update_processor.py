@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+import logging
+from http import HTTPStatus
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue(asyncio.Queue):
+    """
+    Черга оновлень з обмеженням прийому. З CONCURRENT_UPDATES > 1 Application одразу забирає кожне
+    оновлення з черги в окреме завдання, тож розмір самої черги навантаження не обмежує. Тому тут
+    рахуються всі прийняті й ще не оброблені оновлення: ті, що в черзі, ті, що чекають на свою чергу
+    користувача чи вільний слот, і ті, що обробляються. put збільшує лічильник, task_done, який Application
+    викликає після обробки, зменшує його. Коли прийнято max_pending оновлень, put чекає
+    (polling перестає отримувати нові оновлення). Службові об'єкти (сигнал зупинки Application) не обмежуються.
+    """
+
+    def __init__(self, max_pending: int):
+        super().__init__()
+        self.max_pending = max_pending
+        self.pending = 0
+        self._released = asyncio.Event()
+
+    async def put(self, item):
+        if isinstance(item, Update):
+            await self._admit(item)
+        # Черга без обмеження розміру: super().put не чекає, тож лічильник і черга змінюються разом
+        self.pending += 1
+        await super().put(item)
+
+    async def _admit(self, update: Update):
+        """Очікування, поки кількість прийнятих оновлень не опуститься нижче max_pending"""
+        while self.pending >= self.max_pending:
+            self._released.clear()
+            await self._released.wait()
+
+    def task_done(self):
+        super().task_done()
+        self.pending -= 1
+        self._released.set()
+
+
+class WebhookUpdateQueue(UpdateQueue):
+    """
+    Черга оновлень для BOT_MODE=webhook. Обробник webhook у PTB чекає на put, тож при вичерпаному ліміті
+    Telegram обірвав би запит за таймаутом і надіслав оновлення ще раз, а обидві копії були б оброблені.
+    Натомість оновлення понад max_pending відхиляється з 503 ще до підтвердження, і Telegram
+    повторює доставку пізніше.
+    """
+
+    async def _admit(self, update: Update):
+        if self.pending >= self.max_pending:
+            # tornado встановлюється разом з python-telegram-bot[webhooks]
+            import tornado.web
+            logger.warning(
+                f"⚠️ Прийнято {self.pending} необроблених оновлень (ліміт {self.max_pending}), "
+                f"оновлення {update.update_id} відхилено з 503"
+            )
+            raise tornado.web.HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, reason="Too many pending updates")
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Паралельна обробка оновлень (не більше max_concurrent_updates одночасно) зі збереженням
+    порядку в межах одного користувача: оновлення користувача (або чату, якщо користувача немає)
+    обробляються строго по черзі, тож ConversationHandler та mark_/cancel_ кнопки не змагаються між собою.
+    Кількість прийнятих оновлень обмежує UpdateQueue.
+    """
+
+    __slots__ = ("_locks", "_slots")
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # process_update тримає self._semaphore на весь do_process_update, разом з очікуванням черги
+        # користувача. Тоді кілька оновлень одного користувача займали б слоти інших, тому
+        # паралельність обмежує _slots, який береться вже після замка користувача
+        self._semaphore = contextlib.nullcontext()
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # Ключ -> [замок, кількість оновлень, що його тримають або чекають]; запис видаляється, коли їх 0
+        self._locks = {}
+
+    @staticmethod
+    def _ordering_key(update: object):
+        """Ключ черговості: ("user", id), ("chat", id) або None для оновлень без користувача й чату"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return "user", update.effective_user.id
+        if update.effective_chat is not None:
+            return "chat", update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        # asyncio.Lock пропускає очікувачів у порядку надходження, тож порядок оновлень зберігається
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
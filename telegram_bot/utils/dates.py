@@ -0,0 +1,33 @@
+from datetime import date as date_type, datetime
+
+# Кодування дат і часу в документах MongoDB:
+# дата -> порядковий номер дня (date.toordinal()), час -> хвилини від півночі.
+# Числа займають менше місця за рядки та порівнюються як числа, а не посимвольно.
+
+
+def date_to_day(value) -> int:
+    """Порядковий номер дня з рядка "YYYY-MM-DD", date або datetime"""
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date_type):
+        value = datetime.strptime(value, "%Y-%m-%d").date()
+    return value.toordinal()
+
+
+def day_to_date(day: int) -> str:
+    """Рядок "YYYY-MM-DD" з порядкового номера дня"""
+    return date_type.fromordinal(day).strftime("%Y-%m-%d")
+
+
+def time_to_minutes(value: str) -> int:
+    """Хвилини від півночі з рядка "HH:MM" (години можуть бути без нуля попереду: "9:05")"""
+    hours, minutes = value.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Неправильний час: {value}")
+    return hours * 60 + minutes
+
+
+def minutes_to_time(minutes: int) -> str:
+    """Рядок "HH:MM" з кількості хвилин від півночі"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"